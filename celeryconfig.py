@@ -15,7 +15,8 @@ result_serializer = 'json'
 task_time_limit = 3600  # 1 hour max runtime for tasks
 task_soft_time_limit = 3300  # Soft limit 55 minutes (gives tasks time to clean up)
 worker_prefetch_multiplier = 1  # Only prefetch one task at a time (good for long tasks)
-worker_max_tasks_per_child = 10  # Restart worker after 10 tasks to prevent memory leaks
+# Worker recycling is configured in server.py (worker_max_memory_per_child), since
+# workers keep a Whisper model resident between tasks
 
 # Log settings
 worker_hijack_root_logger = False
@@ -0,0 +1,442 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI, APITimeoutError, RateLimitError
+from tqdm import tqdm
+from ranking_cache import ResponseCache
+
+# How often a pending request re-checks whether it is due for a hedge, in seconds
+HEDGE_POLL_INTERVAL = 0.25
+
+# Parses (messages, reply) into valid clips plus follow-up messages for malformed ones
+Repair = Callable[[List[Dict], str], Tuple[List[Dict], Optional[List[Dict]]]]
+
+class AdaptiveConcurrencyController:
+    """AIMD limit on requests in flight, in the spirit of TCP congestion control.
+
+    While responses come back within `latency_slack` times the best latency seen so
+    far, the limit grows by about one request per round trip (additive increase). A
+    429 or a timeout halves it (multiplicative decrease), at most once per round trip
+    so one burst of failures counts as a single congestion signal. A Retry-After
+    header pauses new requests until it expires. With adaptive=False the limit stays
+    at max_limit and this behaves like a plain semaphore.
+    """
+
+    def __init__(self, max_limit: int, initial_limit: Optional[int] = None, min_limit: int = 1,
+                 adaptive: bool = True, latency_slack: float = 2.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.adaptive = adaptive
+        self.latency_slack = latency_slack
+        self.limit = float(initial_limit or (max(min_limit, max_limit // 2) if adaptive else max_limit))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.best_latency = None
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+        # Run statistics for the summary
+        self.started = time.time()
+        self.completed = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self._limit_samples = []
+
+    async def acquire(self):
+        async with self._condition:
+            while True:
+                wait = self.paused_until - time.time()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, latency: float, outcome: str, retry_after: Optional[float] = None):
+        """Record one finished request; outcome is 'ok', 'throttled', 'timeout' or 'error'."""
+        async with self._condition:
+            self.in_flight -= 1
+            now = time.time()
+            if outcome == 'ok':
+                self.completed += 1
+                self.best_latency = latency if self.best_latency is None else min(self.best_latency, latency)
+                if self.adaptive and latency <= self.best_latency * self.latency_slack:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif outcome in ('throttled', 'timeout'):
+                if outcome == 'throttled':
+                    self.throttled += 1
+                else:
+                    self.timeouts += 1
+                round_trip = self.best_latency or latency
+                if self.adaptive and now - self._last_decrease >= round_trip:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self._limit_samples.append(self.limit)
+            self._condition.notify_all()
+
+    def summary(self) -> str:
+        elapsed = max(time.time() - self.started, 1e-9)
+        mean_limit = sum(self._limit_samples) / len(self._limit_samples) if self._limit_samples else self.limit
+        return (f"Effective rate: {self.completed / elapsed:.2f} requests/s, "
+                f"concurrency limit {self.limit:.1f} (mean {mean_limit:.1f}, max {self.max_limit}), "
+                f"{self.throttled} throttled, {self.timeouts} timed out")
+
+class LatencyTracker:
+    """Latencies observed during the current run, kept sorted for percentile queries."""
+
+    def __init__(self):
+        self._samples = []
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, latency: float):
+        bisect.insort(self._samples, latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Nearest-rank percentile, or None before any sample."""
+        if not self._samples:
+            return None
+        rank = max(1, math.ceil(q / 100.0 * len(self._samples)))
+        return self._samples[min(rank, len(self._samples)) - 1]
+
+    def summary(self, label: str) -> str:
+        if not self._samples:
+            return f"{label}: no samples"
+        p50, p95, p99 = (self.percentile(q) for q in (50, 95, 99))
+        return f"{label}: p50 {p50:.2f}s, p95 {p95:.2f}s, p99 {p99:.2f}s over {len(self._samples)}"
+
+class RequestStats:
+    """Request latency and token usage for one model tier; safe to share between threads."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.latencies = LatencyTracker()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, usage=None):
+        with self._lock:
+            self.latencies.record(latency)
+            if usage is not None:
+                self.prompt_tokens += getattr(usage, 'prompt_tokens', 0) or 0
+                self.completion_tokens += getattr(usage, 'completion_tokens', 0) or 0
+
+    def summary(self) -> str:
+        if not len(self.latencies):
+            return f"{self.label}: no requests"
+        return (f"{self.latencies.summary(self.label)} requests, "
+                f"{self.prompt_tokens} prompt + {self.completion_tokens} completion tokens")
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read a Retry-After header (seconds or HTTP date) from an API error, if present."""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+class AsyncRankingEngine:
+    """Rank clip chunks concurrently through one shared client and keep-alive connection pool.
+
+    Every request goes through the same AsyncOpenAI client, so connections and TLS
+    sessions are reused across chunks. A semaphore bounds the number of requests in
+    flight and each request is cut off after `request_timeout` seconds. `base_url`
+    can point at any OpenAI-compatible server, e.g. a local stand-in for testing.
+    With `adaptive`, the number of requests in flight is tuned by an
+    AdaptiveConcurrencyController between 1 and `max_concurrency`. A ResponseCache,
+    when given, answers repeated prompts without touching the network.
+
+    With `hedge_percentile`, a request still unanswered after that percentile of the
+    latencies seen so far in this run gets a duplicate, and whichever answers first
+    wins. Hedging starts after `hedge_min_samples` responses, and duplicates are
+    capped at `hedge_budget` (a fraction) of all requests.
+
+    Each chunk's reply is limited to `max_tokens`; latency and token usage of
+    successful requests are added to `stats` when given.
+    """
+
+    def __init__(self, api_key: str, site_url: str = "", site_name: str = "",
+                 base_url: str = "https://openrouter.ai/api/v1", max_concurrency: int = 8,
+                 request_timeout: float = 60.0, max_retries: int = 3, retry_delay: float = 2.0,
+                 adaptive: bool = False, cache: Optional[ResponseCache] = None,
+                 hedge_percentile: Optional[float] = None, hedge_budget: float = 0.1,
+                 hedge_min_samples: int = 10, max_tokens: int = 1000,
+                 stats: Optional[RequestStats] = None):
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.cache = cache
+        self.max_tokens = max_tokens
+        self.stats = stats
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_concurrency,
+                                max_keepalive_connections=max_concurrency),
+            timeout=request_timeout,
+        )
+        self.client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            default_headers={
+                "HTTP-Referer": site_url,
+                "X-Title": site_name,
+            },
+            http_client=self._http_client,
+            # Retries are handled here so backoff happens outside the semaphore
+            max_retries=0,
+        )
+        self.controller = AdaptiveConcurrencyController(max_concurrency, adaptive=adaptive)
+
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.hedge_min_samples = hedge_min_samples
+        self.request_latencies = LatencyTracker()
+        self.chunk_latencies = LatencyTracker()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def complete(self, messages: List[Dict], model: str, temperature: float = 1,
+                       max_tokens: int = 1000) -> str:
+        """Send one chat completion, retrying with exponential backoff."""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.key(model, messages, temperature, max_tokens)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        retry_delay = self.retry_delay
+        for attempt in range(self.max_retries):
+            try:
+                content = await self._hedged_request(messages, model, temperature, max_tokens)
+                if cache_key is not None and content:
+                    self.cache.put(cache_key, content)
+                return content
+            except Exception as e:
+                if attempt < self.max_retries - 1:
+                    retry_after = retry_after_seconds(e) if isinstance(e, RateLimitError) else None
+                    delay = max(retry_delay, retry_after or 0)
+                    print(f"Attempt {attempt + 1} failed ({type(e).__name__}). Retrying in {delay} seconds...")
+                    await asyncio.sleep(delay)
+                    retry_delay *= 2
+                else:
+                    raise Exception(f"Failed to rank clips after {self.max_retries} attempts: {str(e)}")
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a request, or None if hedging is off or over budget."""
+        if self.hedge_percentile is None or len(self.request_latencies) < self.hedge_min_samples:
+            return None
+        if self.hedges >= self.hedge_budget * self.requests:
+            return None
+        return self.request_latencies.percentile(self.hedge_percentile)
+
+    async def _hedged_request(self, messages: List[Dict], model: str, temperature: float,
+                              max_tokens: int) -> str:
+        """Send a request, racing a duplicate against it if it is slower than usual."""
+        self.requests += 1
+        started = asyncio.Event()
+        primary = asyncio.create_task(self._request(messages, model, temperature, max_tokens, started))
+        if self.hedge_percentile is None:
+            return await primary
+
+        # Time the request from when it gets a concurrency slot, like the recorded latencies
+        waiter = asyncio.create_task(started.wait())
+        await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        sent = time.time()
+        while not primary.done():
+            delay = self._hedge_delay()
+            if delay is None and len(self.request_latencies) >= self.hedge_min_samples:
+                # Hedge budget used up
+                return await primary
+            # Re-check periodically: the percentile moves as latencies come in
+            timeout = HEDGE_POLL_INTERVAL if delay is None else min(HEDGE_POLL_INTERVAL, sent + delay - time.time())
+            if timeout <= 0:
+                break
+            await asyncio.wait({primary}, timeout=timeout)
+        if primary.done():
+            return await primary
+
+        self.hedges += 1
+        self.requests += 1
+        hedge = asyncio.create_task(self._request(messages, model, temperature, max_tokens, None))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _request(self, messages: List[Dict], model: str, temperature: float,
+                       max_tokens: int, started: Optional[asyncio.Event]) -> str:
+        """One API call, holding a concurrency slot for its duration."""
+        await self.controller.acquire()
+        if started is not None:
+            started.set()
+        start = time.time()
+        outcome, retry_after = 'error', None
+        try:
+            completion = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                ),
+                timeout=self.request_timeout,
+            )
+            if not (completion and completion.choices):
+                raise ValueError("Empty completion")
+            outcome = 'ok'
+            self.request_latencies.record(time.time() - start)
+            if self.stats is not None:
+                self.stats.record(time.time() - start, getattr(completion, 'usage', None))
+            return completion.choices[0].message.content
+        except asyncio.CancelledError:
+            # Lost a hedging race; not a signal about the server
+            outcome = 'cancelled'
+            raise
+        except RateLimitError as e:
+            outcome, retry_after = 'throttled', retry_after_seconds(e)
+            raise
+        except (asyncio.TimeoutError, APITimeoutError):
+            outcome = 'timeout'
+            raise
+        finally:
+            await self.controller.release(time.time() - start, outcome, retry_after)
+
+    async def rank_chunk(self, clips: List[Dict], chunk_id: int, model: str,
+                         build_messages: Callable[[List[Dict]], List[Dict]],
+                         parse: Callable[[str], List[Dict]],
+                         repair: Optional[Repair] = None, max_reasks: int = 1) -> List[Dict]:
+        """Rank one chunk, returning [] on failure like the threaded path.
+
+        With `repair`, the reply is parsed by it instead of `parse`; when it returns
+        follow-up messages for malformed items, those are sent (up to max_reasks
+        times) and the corrected items are added to the chunk's results.
+        """
+        try:
+            messages = build_messages(clips)
+            reply = await self.complete(messages, model, max_tokens=self.max_tokens)
+            if repair is None:
+                return parse(reply)
+            ranked, followup = repair(messages, reply)
+        except Exception as e:
+            print(f"Warning: Failed to process chunk {chunk_id}: {str(e)}")
+            return []
+
+        for _ in range(max_reasks):
+            if not followup:
+                break
+            try:
+                reply = await self.complete(followup, model, max_tokens=self.max_tokens)
+                fixed, followup = repair(followup, reply or "")
+            except Exception as e:
+                print(f"Warning: Re-ask for chunk {chunk_id} failed: {str(e)}")
+                break
+            ranked.extend(fixed)
+        return ranked
+
+    async def rank_all(self, chunks: Iterable[List[Dict]], model: str,
+                       build_messages: Callable[[List[Dict]], List[Dict]],
+                       parse: Callable[[str], List[Dict]],
+                       total: Optional[int] = None, repair: Optional[Repair] = None,
+                       max_reasks: int = 1,
+                       on_result: Optional[Callable[[List[Dict]], None]] = None) -> List[Dict]:
+        """Rank every chunk concurrently and return all parsed clips.
+
+        `chunks` may be a blocking iterator (such as a followed .jsonl stream); it is
+        advanced in a worker thread so the event loop keeps serving requests meanwhile.
+        `on_result` is called with each chunk's clips as soon as that chunk finishes.
+        """
+        pbar = tqdm(total=total, desc="Processing chunks")
+        tasks = []
+
+        async def run(chunk, chunk_id):
+            start = time.time()
+            result = await self.rank_chunk(chunk, chunk_id, model, build_messages, parse,
+                                           repair=repair, max_reasks=max_reasks)
+            self.chunk_latencies.record(time.time() - start)
+            # Tag clips with their chunk so callers can pick per-chunk winners
+            for clip in result:
+                if isinstance(clip, dict):
+                    clip.setdefault('chunk', chunk_id)
+            if on_result is not None:
+                on_result(result)
+            pbar.update(1)
+            return result
+
+        iterator = iter(chunks)
+        sentinel = object()
+        chunk_id = 0
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, sentinel)
+            if chunk is sentinel:
+                break
+            tasks.append(asyncio.create_task(run(chunk, chunk_id)))
+            chunk_id += 1
+
+        all_ranked_clips = []
+        for result in await asyncio.gather(*tasks):
+            all_ranked_clips.extend(result)
+        pbar.close()
+        return all_ranked_clips
+
+    def hedge_summary(self) -> str:
+        rate = 100.0 * self.hedges / self.requests if self.requests else 0.0
+        return (f"Hedging: {self.hedges} of {self.requests} requests hedged ({rate:.1f}%), "
+                f"{self.hedge_wins} won by the hedge")
+
+    async def aclose(self):
+        await self.client.close()
+
+def run_ranking_engine(chunks: Iterable[List[Dict]], api_key: str, model: str,
+                       build_messages: Callable[[List[Dict]], List[Dict]],
+                       parse: Callable[[str], List[Dict]], total: Optional[int] = None,
+                       repair: Optional[Repair] = None, max_reasks: int = 1,
+                       on_result: Optional[Callable[[List[Dict]], None]] = None,
+                       **engine_options) -> List[Dict]:
+    """Run an AsyncRankingEngine over all chunks from synchronous code."""
+    async def run():
+        engine = AsyncRankingEngine(api_key, **engine_options)
+        try:
+            start = time.time()
+            ranked = await engine.rank_all(chunks, model, build_messages, parse, total=total,
+                                           repair=repair, max_reasks=max_reasks, on_result=on_result)
+            print(f"Async ranking finished in {time.time() - start:.2f} seconds")
+            print(engine.controller.summary())
+            print(engine.chunk_latencies.summary("Chunk latency"))
+            if engine.hedge_percentile is not None:
+                print(engine.hedge_summary())
+            return ranked
+        finally:
+            await engine.aclose()
+
+    return asyncio.run(run())
@@ -0,0 +1,24 @@
+def describe_audio_features(avg_volume, avg_zcr, avg_spectral_centroid):
+    """Build the audio_features dict used in the enhanced transcription"""
+    # Determine volume level
+    if avg_volume < 0.1:
+        volume_level = "quiet"
+    elif avg_volume < 0.3:
+        volume_level = "normal"
+    else:
+        volume_level = "loud"
+
+    # Estimate emotional characteristics based on audio features
+    intensity = "high" if avg_zcr > 0.15 and avg_spectral_centroid > 2000 else "normal"
+
+    return {
+        "volume": {
+            "level": volume_level,
+            "value": avg_volume
+        },
+        "characteristics": {
+            "intensity": intensity,
+            "zero_crossing_rate": avg_zcr,
+            "spectral_centroid": avg_spectral_centroid
+        }
+    }
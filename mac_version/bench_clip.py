@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from clip import EXTRACTORS
+
+def probe_duration(path):
+    """Container duration of a clip in seconds, or None if ffprobe cannot read it"""
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', str(path)
+    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+def benchmark_mode(mode, input_file, output_dir, clips):
+    """Extract clips with one mode, returning wall time and per-clip duration errors"""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.time()
+    results = EXTRACTORS[mode](input_file, output_dir, clips)
+    elapsed = time.time() - start
+
+    errors = []
+    succeeded = 0
+    for clip, success, result in results:
+        if not success:
+            print(f"  {mode}: {clip['name']} failed: {result}")
+            continue
+        succeeded += 1
+        duration = probe_duration(result)
+        if duration is not None:
+            errors.append(abs(duration - (clip["end"] - clip["start"])))
+    return {
+        'mode': mode,
+        'seconds': elapsed,
+        'per_clip': elapsed / len(clips) if clips else 0.0,
+        'succeeded': succeeded,
+        'total': len(clips),
+        'mean_error': sum(errors) / len(errors) if errors else None,
+        'max_error': max(errors) if errors else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark clip extraction modes on one VOD.')
+    parser.add_argument('input_file', help='Input video file path')
+    parser.add_argument('json_file', help='JSON file containing clip information (top_clips_one.json)')
+    parser.add_argument('--modes', nargs='+', default=list(EXTRACTORS), choices=list(EXTRACTORS),
+                        help='Extraction modes to compare (default: all)')
+    parser.add_argument('--clips', type=int, default=5, help='Number of clips to extract per mode (default: 5)')
+    parser.add_argument('--output-dir', default=None, help='Keep the extracted clips here instead of a temporary directory')
+
+    args = parser.parse_args()
+
+    with open(args.json_file, 'r') as f:
+        clips = json.load(f)["top_clips"][:args.clips]
+    if not clips:
+        print("No clips to extract")
+        sys.exit(1)
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='bench_clip-')
+    try:
+        stats = []
+        for mode in args.modes:
+            print(f"\nBenchmarking {mode} on {len(clips)} clips...")
+            stats.append(benchmark_mode(mode, args.input_file, os.path.join(output_dir, mode), clips))
+    finally:
+        if args.output_dir is None:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    baseline = next((s for s in stats if s['mode'] == 'reencode'), None)
+    print(f"\n{'mode':<10}{'total s':>10}{'s/clip':>10}{'speedup':>10}{'ok':>8}{'mean |dt|':>12}{'max |dt|':>12}")
+    for s in stats:
+        speedup = f"{baseline['seconds'] / s['seconds']:.1f}x" if baseline and s['seconds'] else '-'
+        mean_error = f"{s['mean_error']:.3f}s" if s['mean_error'] is not None else '-'
+        max_error = f"{s['max_error']:.3f}s" if s['max_error'] is not None else '-'
+        print(f"{s['mode']:<10}{s['seconds']:>10.2f}{s['per_clip']:>10.2f}{speedup:>10}"
+              f"{s['succeeded']:>4}/{s['total']:<3}{mean_error:>12}{max_error:>12}")
+    print("\n|dt| is the difference between each clip's duration and its requested end - start.")
+
+if __name__ == "__main__":
+    main()
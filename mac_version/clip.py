@@ -4,38 +4,358 @@ import argparse
 import json
 import sys
 import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from keyframe_index import KeyframeIndex, remove_index
 
-def extract_clip(input_file, output_dir, clip_data):
+# Encoder settings for re-encoded pieces; boundary GOPs must concatenate with copied H.264
+X264_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p']
+# Pieces shorter than this (seconds) are dropped rather than encoded
+MIN_PIECE = 0.001
+
+# Encoder threads per clip; set in pool workers so encodes stay within the core budget
+ENCODER_THREADS = None
+
+def x264_args():
+    """
+    libx264 output options, limited to ENCODER_THREADS when set
+    """
+    if ENCODER_THREADS:
+        return X264_ARGS + ['-threads', str(ENCODER_THREADS)]
+    return X264_ARGS
+
+def clip_output_path(output_dir, clip_data):
+    """
+    Output path for a clip, named after the sanitized clip name
+    """
+    safe_name = "".join(c for c in clip_data["name"] if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return os.path.join(output_dir, f"{safe_name}.mp4")
+
+def extract_clip(input_file, output_dir, clip_data, video=None, timings=None):
     """
     Extract a single clip based on the provided clip data
+
+    When an open `video` is given it is reused instead of opening input_file again.
+    Seek and encode times are stored in `timings` when a dict is passed.
     """
+    own_video = video is None
     try:
-        # Create sanitized filename from clip name
-        safe_name = "".join(c for c in clip_data["name"] if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        output_file = os.path.join(output_dir, f"{safe_name}.mp4")
+        output_file = clip_output_path(output_dir, clip_data)
         
         # Load the video file
-        video = VideoFileClip(input_file)
+        if own_video:
+            video = VideoFileClip(input_file)
         
         # Extract the clip using start and end times from JSON
+        seek_start = time.time()
         clip = video.subclipped(clip_data["start"], clip_data["end"])
+        # Reading the first frame makes the shared reader seek to the clip start
+        clip.get_frame(0)
+        encode_start = time.time()
         
         # Write the clip to a new file
-        clip.write_videofile(output_file, codec='libx264')
+        clip.write_videofile(output_file, codec='libx264', threads=ENCODER_THREADS)
         
-        # Clean up
-        clip.close()
-        video.close()
+        if timings is not None:
+            timings['seek'] = encode_start - seek_start
+            timings['encode'] = time.time() - encode_start
         
+        # The subclip shares the source's readers, which are closed with the source
         return True, output_file
         
     except Exception as e:
         return False, str(e)
+    finally:
+        if own_video and video is not None:
+            video.close()
+
+def extract_clips(input_file, output_dir, clips):
+    """
+    Extract clips from one open reader, in timestamp order so seeks only move forward
+
+    Returns (clip_data, success, result) tuples in the order the clips were given.
+    """
+    order = sorted(range(len(clips)), key=lambda i: (clips[i]["start"], clips[i]["end"]))
+    results = [None] * len(clips)
+    try:
+        video = VideoFileClip(input_file)
+    except Exception as e:
+        return [(clip, False, str(e)) for clip in clips]
+
+    try:
+        for n, i in enumerate(order, 1):
+            timings = {}
+            success, result = extract_clip(input_file, output_dir, clips[i], video=video, timings=timings)
+            results[i] = (clips[i], success, result)
+            if success:
+                print(f"[{n}/{len(clips)}] {clips[i]['name']}: seek {timings['seek']:.2f}s, "
+                      f"encode {timings['encode']:.2f}s")
+    finally:
+        video.close()
+    return results
+
+def run_ffmpeg(args):
+    """
+    Run ffmpeg quietly, raising with its error output on failure
+    """
+    result = subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', *args],
+                            stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+def seek_input_args(index, keyframe):
+    """
+    ffmpeg input options that start reading at a keyframe, keeping source timestamps
+
+    MPEG-TS sources are entered at the keyframe's byte offset, with no timestamp
+    search; other containers fall back to seeking by time.
+    """
+    if index.byte_seekable:
+        return ['-skip_initial_bytes', str(int(index.offsets[keyframe])), '-copyts']
+    return ['-ss', f"{index.times[keyframe]:.6f}", '-copyts']
+
+def cut_clip_copy(input_file, output_file, start, end, index):
+    """
+    Cut a clip by stream copy, without re-encoding
+
+    The clip starts at the keyframe at or before `start`, so it can begin up to one
+    GOP early.
+    """
+    run_ffmpeg([
+        *seek_input_args(index, index.before(start)), '-i', str(input_file),
+        '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy',
+        '-to', f"{index.absolute(end):.6f}",
+        '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart',
+        str(output_file)
+    ])
+
+def extract_clips_copy(input_file, output_dir, clips):
+    """
+    Extract clips by keyframe-aligned stream copy, for when GOP precision is enough
+
+    Returns (clip_data, success, result) tuples in the order the clips were given.
+    """
+    try:
+        index = KeyframeIndex.open(input_file)
+    except Exception as e:
+        return [(clip, False, str(e)) for clip in clips]
 
-def process_clips(input_file, output_dir, json_file, min_score=0):
+    results = []
+    for n, clip in enumerate(clips, 1):
+        output_file = clip_output_path(output_dir, clip)
+        cut_start = time.time()
+        try:
+            cut_clip_copy(input_file, output_file, clip["start"], clip["end"], index)
+        except Exception as e:
+            results.append((clip, False, str(e)))
+            continue
+        results.append((clip, True, output_file))
+        print(f"[{n}/{len(clips)}] {clip['name']}: cut {time.time() - cut_start:.2f}s")
+    return results
+
+def probe_video_codec(input_file):
+    """
+    Codec name of the first video stream
+    """
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', str(input_file)
+    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+def cut_clip_encode(input_file, output_file, start, end):
+    """
+    Cut a clip exactly by re-encoding it with ffmpeg
+    """
+    run_ffmpeg([
+        '-ss', f"{start:.3f}", '-i', str(input_file), '-t', f"{end - start:.3f}",
+        '-map', '0:v:0', '-map', '0:a:0?', *x264_args(), '-c:a', 'aac',
+        '-movflags', '+faststart', str(output_file)
+    ])
+
+def cut_clip_smart(input_file, output_file, start, end, index, work_dir):
+    """
+    Cut a frame-accurate clip, re-encoding only the partial GOPs at either end
+
+    Video from the first keyframe after `start` to the last keyframe before `end` is
+    stream copied. The pieces before and after it are re-encoded, and the three are
+    concatenated as MPEG-TS so parameter sets travel in-band. Audio is cheap to encode,
+    so it is re-encoded over the exact range and muxed in. Every piece starts reading
+    at a keyframe from the index and is trimmed on source timestamps. Clips without
+    a whole GOP inside are simply re-encoded.
+    Returns the seconds of video that were stream copied.
+    """
+    first = index.after(start)
+    last = index.before(end)
+    if first >= len(index) or index.times[last] > end or first >= last:
+        cut_clip_encode(input_file, output_file, start, end)
+        return 0.0
+    copy_start, copy_end = index.times[first], index.times[last]
+    absolute = index.absolute
+
+    pieces = []
+    def encode_piece(name, piece_start, piece_end):
+        if piece_end - piece_start < MIN_PIECE:
+            return
+        path = os.path.join(work_dir, name)
+        run_ffmpeg([*seek_input_args(index, index.before(piece_start)), '-i', str(input_file),
+                    '-map', '0:v:0', '-an',
+                    '-vf', f"trim=start={absolute(piece_start):.6f}:end={absolute(piece_end):.6f},setpts=PTS-STARTPTS",
+                    *x264_args(), '-f', 'mpegts', path])
+        pieces.append(path)
+
+    encode_piece('head.ts', start, copy_start)
+    # Reading starts on the first whole-GOP keyframe; -to stops before the last one
+    middle = os.path.join(work_dir, 'middle.ts')
+    run_ffmpeg([*seek_input_args(index, first), '-i', str(input_file),
+                '-map', '0:v:0', '-an', '-c', 'copy', '-to', f"{absolute(copy_end):.6f}",
+                '-f', 'mpegts', middle])
+    pieces.append(middle)
+    encode_piece('tail.ts', copy_end, end)
+
+    # Start a GOP early so audio muxed ahead of the video is not skipped
+    audio = os.path.join(work_dir, 'audio.m4a')
+    run_ffmpeg([*seek_input_args(index, max(index.before(start) - 1, 0)), '-i', str(input_file),
+                '-map', '0:a:0?', '-vn',
+                '-af', f"atrim=start={absolute(start):.6f}:end={absolute(end):.6f},asetpts=PTS-STARTPTS",
+                '-c:a', 'aac', audio])
+
+    concat_list = os.path.join(work_dir, 'pieces.txt')
+    with open(concat_list, 'w') as f:
+        f.writelines(f"file '{path}'\n" for path in pieces)
+    run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', concat_list, '-i', audio,
+                '-map', '0:v:0', '-map', '1:a:0?', '-c', 'copy',
+                '-movflags', '+faststart', str(output_file)])
+    return copy_end - copy_start
+
+def extract_clips_smart(input_file, output_dir, clips):
+    """
+    Extract frame-accurate clips, stream copying everything but the boundary GOPs
+
+    Falls back to a full re-encode per clip when the source is not H.264.
+    Returns (clip_data, success, result) tuples in the order the clips were given.
+    """
+    try:
+        copyable = probe_video_codec(input_file) == 'h264'
+        index = KeyframeIndex.open(input_file) if copyable else None
+    except Exception as e:
+        return [(clip, False, str(e)) for clip in clips]
+    if not copyable:
+        print("Source video is not H.264, smart-cut will re-encode whole clips")
+
+    results = []
+    for n, clip in enumerate(clips, 1):
+        output_file = clip_output_path(output_dir, clip)
+        cut_start = time.time()
+        work_dir = tempfile.mkdtemp(prefix='.smartcut-', dir=output_dir)
+        try:
+            if copyable:
+                copied = cut_clip_smart(input_file, output_file, clip["start"], clip["end"], index, work_dir)
+            else:
+                cut_clip_encode(input_file, output_file, clip["start"], clip["end"])
+                copied = 0.0
+        except Exception as e:
+            results.append((clip, False, str(e)))
+            continue
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results.append((clip, True, output_file))
+        duration = clip["end"] - clip["start"]
+        print(f"[{n}/{len(clips)}] {clip['name']}: cut {time.time() - cut_start:.2f}s, "
+              f"{copied:.1f}s of {duration:.1f}s stream copied")
+    return results
+
+EXTRACTORS = {
+    'reencode': extract_clips,
+    'copy': extract_clips_copy,
+    'smart': extract_clips_smart,
+}
+
+# Per-process state of clip extraction pool workers
+_worker_input = None
+_worker_mode = None
+_worker_video = None
+
+def _init_clip_worker(input_file, mode, threads):
+    """
+    Limit encoder threads in a pool process and, for moviepy, open the source once
+    """
+    global ENCODER_THREADS, _worker_input, _worker_mode, _worker_video
+    ENCODER_THREADS = threads
+    _worker_input = input_file
+    _worker_mode = mode
+    if mode == 'reencode':
+        try:
+            _worker_video = VideoFileClip(input_file)
+        except Exception:
+            # extract_clip opens the source itself and reports the error per clip
+            _worker_video = None
+
+def _extract_in_worker(output_dir, clip):
+    """
+    Extract one clip in a pool worker, returning (success, result, seconds)
+    """
+    start = time.time()
+    if _worker_mode == 'reencode':
+        success, result = extract_clip(_worker_input, output_dir, clip, video=_worker_video)
+    else:
+        [(_, success, result)] = EXTRACTORS[_worker_mode](_worker_input, output_dir, [clip])
+    return success, result, time.time() - start
+
+def extract_clips_parallel(input_file, output_dir, clips, mode='reencode', workers=2, core_budget=None):
+    """
+    Extract clips concurrently in a process pool, within a budget of CPU cores
+
+    Each of the workers gets core_budget // workers encoder threads, so concurrent
+    encodes do not oversubscribe the node. Clips are submitted in timestamp order and
+    collected as they finish.
+    Returns (clip_data, success, result) tuples in the order the clips were given.
+    """
+    if not clips:
+        return []
+    core_budget = core_budget or os.cpu_count() or 1
+    workers = max(1, min(workers, core_budget, len(clips)))
+    threads = max(1, core_budget // workers)
+    if mode != 'reencode':
+        # Build the keyframe index once here rather than racing to build it in every worker
+        try:
+            KeyframeIndex.open(input_file)
+        except Exception as e:
+            return [(clip, False, str(e)) for clip in clips]
+
+    print(f"Extracting {len(clips)} clips with {workers} workers x {threads} encoder threads "
+          f"(core budget {core_budget})")
+    order = sorted(range(len(clips)), key=lambda i: (clips[i]["start"], clips[i]["end"]))
+    results = [None] * len(clips)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_clip_worker,
+                             initargs=(input_file, mode, threads)) as executor:
+        futures = {executor.submit(_extract_in_worker, output_dir, clips[i]): i for i in order}
+        for n, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            try:
+                success, result, seconds = future.result()
+            except Exception as e:
+                success, result, seconds = False, str(e), 0.0
+            results[i] = (clips[i], success, result)
+            status = f"done in {seconds:.2f}s" if success else "failed"
+            print(f"[{n}/{len(clips)}] {clips[i]['name']}: {status}")
+    return results
+
+def process_clips(input_file, output_dir, json_file, min_score=0, mode='reencode',
+                  workers=1, core_budget=None):
     """
     Process all clips from the JSON file that meet the minimum score requirement
+
+    mode 'reencode' cuts frame-accurately through moviepy and libx264; 'copy' stream
+    copies from the nearest preceding keyframe; 'smart' is frame-accurate but only
+    re-encodes the GOPs at the clip boundaries. With more than one worker, clips are
+    encoded in parallel within core_budget cores.
     """
     try:
         # Create output directory if it doesn't exist
@@ -49,13 +369,16 @@ def process_clips(input_file, output_dir, json_file, min_score=0):
         successful_clips = []
         failed_clips = []
         
-        for clip in data["top_clips"]:
-            if clip["score"] >= min_score:
-                success, result = extract_clip(input_file, output_dir, clip)
-                if success:
-                    successful_clips.append((clip["name"], result))
-                else:
-                    failed_clips.append((clip["name"], result))
+        selected = [clip for clip in data["top_clips"] if clip["score"] >= min_score]
+        if workers > 1:
+            extracted = extract_clips_parallel(input_file, output_dir, selected, mode, workers, core_budget)
+        else:
+            extracted = EXTRACTORS[mode](input_file, output_dir, selected)
+        for clip, success, result in extracted:
+            if success:
+                successful_clips.append((clip["name"], result))
+            else:
+                failed_clips.append((clip["name"], result))
         
         # Print summary
         print(f"\nExtraction Summary:")
@@ -76,6 +399,9 @@ def process_clips(input_file, output_dir, json_file, min_score=0):
             try:
                 os.remove(input_file)
                 print(f"\nOriginal VOD file removed: {input_file}")
+                # The index is only valid for this VOD, so it can never be reused
+                if remove_index(input_file):
+                    print("Keyframe index removed")
             except Exception as e:
                 print(f"\nFailed to remove VOD file: {str(e)}")
         elif remove_vod and failed_clips:
@@ -90,10 +416,17 @@ def main():
     parser.add_argument('output_dir', help='Output directory for clips')
     parser.add_argument('json_file', help='JSON file containing clip information')
     parser.add_argument('--min-score', type=int, default=0, help='Minimum score threshold for clips (default: 0)')
+    parser.add_argument('--mode', default='reencode', choices=list(EXTRACTORS),
+                        help='reencode: exact cuts with libx264 (default); copy: fast stream copy, clips start on the preceding keyframe; '
+                             'smart: exact cuts that only re-encode the boundary GOPs')
+    parser.add_argument('--workers', type=int, default=1, help='Clips to encode in parallel (default: 1)')
+    parser.add_argument('--core-budget', type=int, default=os.cpu_count(),
+                        help='CPU cores shared by all parallel encodes (default: all cores)')
     
     args = parser.parse_args()
     
-    process_clips(args.input_file, args.output_dir, args.json_file, args.min_score)
+    process_clips(args.input_file, args.output_dir, args.json_file, args.min_score, args.mode,
+                  args.workers, args.core_budget)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,91 @@
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+from audio_features import describe_audio_features
+
+# Suffix of the columnar artifact written next to the video
+COLUMNAR_SUFFIX = '.enhanced_transcription.cols'
+
+# Numeric columns and where they live in the JSON schema
+COLUMNS = ('start', 'end', 'volume', 'zero_crossing_rate', 'spectral_centroid')
+
+def is_columnar(path):
+    """Check whether a path points at a columnar transcription directory"""
+    return str(path).rstrip('/').endswith(COLUMNAR_SUFFIX) or os.path.isfile(os.path.join(path, 'text.bin'))
+
+def write_columnar(path, segments):
+    """Write enhanced transcription segments as one .npy file per column plus a text blob
+
+    Texts are concatenated UTF-8 in text.bin, with text_offsets.npy holding n + 1 byte
+    offsets so segment i is text.bin[offsets[i]:offsets[i + 1]].
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    columns = {
+        'start': [seg['start'] for seg in segments],
+        'end': [seg['end'] for seg in segments],
+        'volume': [seg['audio_features']['volume']['value'] for seg in segments],
+        'zero_crossing_rate': [seg['audio_features']['characteristics']['zero_crossing_rate'] for seg in segments],
+        'spectral_centroid': [seg['audio_features']['characteristics']['spectral_centroid'] for seg in segments],
+    }
+    for name, values in columns.items():
+        np.save(tmp_path / f"{name}.npy", np.asarray(values, dtype=np.float64))
+
+    encoded = [seg['text'].encode('utf-8') for seg in segments]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    np.save(tmp_path / 'text_offsets.npy', offsets)
+    with open(tmp_path / 'text.bin', 'wb') as f:
+        f.write(b''.join(encoded))
+
+    # Swap the finished directory into place so readers never see a partial artifact
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+class ColumnarTranscription:
+    """Memory-mapped view of a columnar transcription
+
+    Numeric columns are read-only NumPy memmaps; texts are decoded on access.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        for name in COLUMNS:
+            setattr(self, name, np.load(self.path / f"{name}.npy", mmap_mode='r'))
+        self.text_offsets = np.load(self.path / 'text_offsets.npy', mmap_mode='r')
+        text_path = self.path / 'text.bin'
+        if os.path.getsize(text_path):
+            self._text = np.memmap(text_path, dtype=np.uint8, mode='r')
+        else:
+            self._text = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.start)
+
+    def text(self, i):
+        lo, hi = int(self.text_offsets[i]), int(self.text_offsets[i + 1])
+        return self._text[lo:hi].tobytes().decode('utf-8')
+
+    def segment(self, i):
+        """Rebuild segment i in the enhanced transcription JSON schema"""
+        return {
+            "start": float(self.start[i]),
+            "end": float(self.end[i]),
+            "text": self.text(i),
+            "audio_features": describe_audio_features(
+                float(self.volume[i]), float(self.zero_crossing_rate[i]), float(self.spectral_centroid[i])
+            )
+        }
+
+    def to_segments(self):
+        return [self.segment(i) for i in range(len(self))]
+
+def read_columnar(path):
+    """Load a columnar transcription as a list of segments in the JSON schema"""
+    return ColumnarTranscription(path).to_segments()
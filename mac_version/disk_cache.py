@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+def write_json_atomic(path, data, **dump_options):
+    """Write JSON under a temporary name and move it into place
+
+    Readers in other threads or processes never see a partial file, and the temporary
+    file is removed if the write fails.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, **dump_options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_entry(tmp_path)
+        raise
+
+def touch_entry(path):
+    """Refresh the access time used for LRU eviction, returning False if the entry is gone"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def remove_entry(path):
+    """Delete a cache entry, returning False if another process already removed it"""
+    try:
+        Path(path).unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+def evict_lru(cache_dir, max_bytes, pattern='*.json', is_expired=None):
+    """Delete expired entries, then the least recently used until the rest fit in max_bytes
+
+    Recency is the file mtime, which touch_entry refreshes on every hit. is_expired, when
+    given, is called with each entry's path and stat result. Returns the removed paths.
+    """
+    entries = []
+    removed = []
+    for path in Path(cache_dir).glob(pattern):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if is_expired is not None and is_expired(path, stat):
+            if remove_entry(path):
+                removed.append(path)
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if remove_entry(path):
+            removed.append(path)
+        total -= size
+    return removed
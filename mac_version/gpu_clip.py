@@ -4,14 +4,51 @@ import json
 import os
 import sys
 import time
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterable, Iterator, Optional
 import re
+import math
+import heapq
 from itertools import islice
 import multiprocessing as mp
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import torch
 import numpy as np
 from tqdm import tqdm
+try:
+    # Exact token counts when tiktoken is installed, otherwise a character estimate
+    import tiktoken
+    _token_encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _token_encoding = None
+from columnar_transcription import is_columnar, read_columnar
+from async_ranking import run_ranking_engine, RequestStats
+from ranking_cache import ResponseCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DEFAULT_TTL_SECONDS
+from disk_cache import write_json_atomic
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+# Options that only configure the async engine; the thread pool ignores them
+ASYNC_ONLY_OPTIONS = ('max_concurrency', 'request_timeout', 'adaptive_concurrency',
+                      'hedge_percentile', 'hedge_budget', 'api_base_url')
+RANKING_MODEL = "deepseek/deepseek-chat"
+SYSTEM_PROMPT = "You are a helpful assistant that ranks video clips. Keep explanations brief and focused on virality potential."
+# Tokens reserved for the model's answer, and roughly what one ranked clip takes in it
+REPLY_TOKENS = 1000
+REPLY_TOKENS_PER_CLIP = 75
+# Reply limit for the score-only screening tier
+SCREEN_REPLY_TOKENS = 256
+# Warn when the screen scores less than this share of the clips
+SCREEN_MIN_SCORED_SHARE = 0.8
+# Schema of one item in a structured (JSON) ranking reply
+RANKED_CLIP_FIELDS = {
+    'name': str,
+    'start': (int, float),
+    'end': (int, float),
+    'score': int,
+    'factors': str,
+    'platforms': str,
+}
+# Follow-up requests allowed per chunk for items that break the schema
+STRUCTURED_REASKS = 1
 
 def setup_gpu():
     """Configure GPU settings."""
@@ -25,8 +62,68 @@ def chunk_list(lst: List, chunk_size: int) -> List[List]:
     """Split a list into chunks of specified size."""
     return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
 
+def iter_chunks(clips: Iterable[Dict], chunk_size: int) -> Iterator[List[Dict]]:
+    """Lazily split an iterable into chunks, so chunks can be used before the input ends."""
+    clips = iter(clips)
+    while True:
+        chunk = list(islice(clips, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def wait_for_stream(parent: int, last_data: float, idle_timeout: float = None) -> None:
+    """Raise if a followed stream can no longer end."""
+    # A killed writer never writes the end-of-stream marker. The pipeline starts this
+    # process from the writer or from a process that waits on it, so being reparented
+    # means the marker is not coming.
+    if os.getppid() != parent:
+        raise RuntimeError("Parent process exited before the transcription stream ended")
+    if idle_timeout is not None and time.time() - last_data > idle_timeout:
+        raise RuntimeError(f"No new transcription data for {idle_timeout:g} seconds")
+
+def iter_clips_jsonl(jsonl_path: str, follow: bool = False, poll_interval: float = 0.5,
+                     idle_timeout: float = None) -> Iterator[Dict]:
+    """Yield clips from a streamed .jsonl transcription.
+
+    With follow, wait for the file to appear and keep tailing it until the writer's
+    end-of-stream marker, like `tail -f`. Following fails instead of waiting forever
+    when the parent process exits or nothing new arrives for idle_timeout seconds.
+    """
+    parent = os.getppid()
+    last_data = time.time()
+    while follow and not os.path.exists(jsonl_path):
+        wait_for_stream(parent, last_data, idle_timeout)
+        time.sleep(poll_interval)
+
+    with open(jsonl_path, 'r', encoding='utf-8') as file:
+        buffer = ""
+        while True:
+            line = file.readline()
+            if not line:
+                if not follow:
+                    break
+                wait_for_stream(parent, last_data, idle_timeout)
+                time.sleep(poll_interval)
+                continue
+            last_data = time.time()
+            buffer += line
+            # Only parse complete lines; the writer may be mid-record
+            if not buffer.endswith('\n'):
+                continue
+            record, buffer = json.loads(buffer), ""
+            if record.get('end_of_stream'):
+                if 'error' in record:
+                    raise RuntimeError(f"Transcription stream ended with an error: {record['error']}")
+                break
+            yield record
+
 def load_clips(json_path: str) -> List[Dict]:
+    """Load clips from a .json or streamed .jsonl transcription, or a columnar .cols directory."""
     try:
+        if is_columnar(json_path):
+            return read_columnar(json_path)
+        if json_path.endswith('.jsonl'):
+            return list(iter_clips_jsonl(json_path))
         with open(json_path, 'r') as file:
             return json.load(file)
     except FileNotFoundError:
@@ -34,36 +131,167 @@ def load_clips(json_path: str) -> List[Dict]:
     except json.JSONDecodeError:
         raise ValueError(f"Invalid JSON format in file: {json_path}")
 
-def process_chunk_gpu(chunk_data: Tuple[List[Dict], str, str, str, int]) -> List[Dict]:
+def prescore_clips(clips: List[Dict], context: int = 3) -> np.ndarray:
+    """Score clips locally from their audio features, without calling the LLM.
+
+    Combines volume, zero crossing rate and spectral centroid with the loudness delta
+    against the `context` clips on either side, each as a robust z-score, so a clip
+    that is loud for its surroundings outranks one that is merely loud all stream.
+    """
+    volume = np.array([c['audio_features']['volume']['value'] for c in clips], dtype=np.float64)
+    zcr = np.array([c['audio_features']['characteristics']['zero_crossing_rate'] for c in clips], dtype=np.float64)
+    centroid = np.array([c['audio_features']['characteristics']['spectral_centroid'] for c in clips], dtype=np.float64)
+
+    # Mean volume of the neighbours within +/- context clips, via prefix sums
+    prefix = np.concatenate(([0.0], np.cumsum(volume)))
+    idx = np.arange(len(clips))
+    lo = np.maximum(idx - context, 0)
+    hi = np.minimum(idx + context + 1, len(clips))
+    neighbours = np.maximum(hi - lo - 1, 1)
+    surrounding = (prefix[hi] - prefix[lo] - volume) / neighbours
+    loudness_delta = volume - surrounding
+
+    def robust_z(values: np.ndarray) -> np.ndarray:
+        median = np.median(values)
+        spread = np.median(np.abs(values - median)) * 1.4826
+        if spread == 0:
+            # More than half the clips share one value; fall back to the standard deviation
+            spread = values.std()
+        return (values - median) / spread if spread > 0 else np.zeros_like(values)
+
+    return (0.35 * robust_z(volume) + 0.35 * robust_z(loudness_delta)
+            + 0.15 * robust_z(zcr) + 0.15 * robust_z(centroid))
+
+def select_top_candidates(clips: List[Dict], top_k: int = None, top_percent: float = None,
+                          context: int = 3) -> List[Dict]:
+    """Keep only the best pre-scored clips for LLM ranking, in their original order."""
+    if not clips or (top_k is None and top_percent is None):
+        return clips
+
+    keep = len(clips)
+    if top_k is not None:
+        keep = min(keep, top_k)
+    if top_percent is not None:
+        keep = min(keep, max(1, int(np.ceil(len(clips) * top_percent / 100.0))))
+
+    scores = prescore_clips(clips, context)
+    # Highest scores first; stable so ties keep stream order
+    best = np.sort(np.argsort(-scores, kind='stable')[:keep])
+    print(f"Pre-ranking kept {keep} of {len(clips)} candidates for LLM ranking")
+    return [clips[i] for i in best]
+
+def process_chunk_gpu(clips: List[Dict], api_key: str, site_url: str, site_name: str, chunk_id: int,
+                      cache: ResponseCache = None, compact: bool = False, structured: bool = False,
+                      model: str = RANKING_MODEL, stats: RequestStats = None) -> List[Dict]:
     """Process a single chunk of clips using GPU acceleration."""
-    clips, api_key, site_url, site_name, chunk_id = chunk_data
-    
+
     try:
         # Move data to GPU if available
         if torch.cuda.is_available():
             torch.cuda.set_device(0)
-        
-        ranked_results = rank_clips_chunk(clips, api_key, site_url, site_name)
-        if ranked_results:
-            parsed_chunk = parse_clip_data(ranked_results)
-            return parsed_chunk
-        return []
+
+        messages = build_ranking_messages(clips, compact, structured)
+        ranked_results = request_completion(messages, api_key, site_url, site_name, cache, model, stats=stats)
+        if not ranked_results:
+            return []
+        if not structured:
+            return [dict(clip, chunk=chunk_id) for clip in parse_clip_data(ranked_results)]
+
+        parsed_chunk, followup = parse_structured_reply(messages, ranked_results)
+        for _ in range(STRUCTURED_REASKS):
+            if not followup:
+                break
+            try:
+                reply = request_completion(followup, api_key, site_url, site_name, cache, model, stats=stats)
+            except Exception as e:
+                print(f"Warning: Re-ask for chunk {chunk_id} failed: {str(e)}")
+                break
+            fixed, followup = parse_structured_reply(followup, reply or "")
+            parsed_chunk.extend(fixed)
+        return [dict(clip, chunk=chunk_id) for clip in parsed_chunk]
     except Exception as e:
         print(f"Warning: Failed to process chunk {chunk_id}: {str(e)}")
         return []
 
-def rank_clips_chunk(clips: List[Dict], api_key: str, site_url: str = "", site_name: str = "") -> str:
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-        default_headers={
-            "HTTP-Referer": site_url,
-            "X-Title": site_name,
-        }
-    )
+def count_tokens(text: str) -> int:
+    """Count prompt tokens, estimating ~4 characters per token without tiktoken."""
+    if _token_encoding is not None:
+        return len(_token_encoding.encode(text))
+    return -(-len(text) // 4)
+
+def compact_clip(clip: Dict) -> Dict:
+    """Flatten a clip to the fields the ranking prompt needs, with rounded features."""
+    features = clip['audio_features']
+    return {
+        'start': round(clip['start'], 2),
+        'end': round(clip['end'], 2),
+        'text': clip['text'].strip(),
+        'volume': round(features['volume']['value'], 4),
+        'level': features['volume']['level'],
+        'intensity': features['characteristics']['intensity'],
+        'zcr': round(features['characteristics']['zero_crossing_rate'], 4),
+        'centroid': round(features['characteristics']['spectral_centroid'], 1),
+    }
+
+def serialize_clips(clips: List[Dict], compact: bool = False) -> str:
+    """Serialize clips for the prompt: pretty-printed as-is, or compact one clip per line."""
+    if not compact:
+        return json.dumps(clips, indent=2)
+    return "[\n" + ",\n".join(json.dumps(compact_clip(c), separators=(',', ':'), ensure_ascii=False)
+                              for c in clips) + "\n]"
+
+def pack_clips_by_tokens(clips: Iterable[Dict], token_budget: int,
+                         reply_tokens: int = REPLY_TOKENS) -> Iterator[List[Dict]]:
+    """Group clips into requests that fill the prompt up to token_budget - reply_tokens.
+
+    Clips are serialized compactly and added greedily; a request also stops once the
+    reply could no longer fit all its ranked clips. A clip too large on its own still
+    gets a request of its own. Works lazily on streamed clips.
+    """
+    prompt_budget = token_budget - reply_tokens - count_tokens(
+        "".join(m["content"] for m in build_ranking_messages([], compact=True)))
+    max_clips = max(1, reply_tokens // REPLY_TOKENS_PER_CLIP)
+
+    chunk, used = [], 0
+    for clip in clips:
+        # +1 for the separator between clips
+        cost = count_tokens(json.dumps(compact_clip(clip), separators=(',', ':'), ensure_ascii=False)) + 1
+        if chunk and (used + cost > prompt_budget or len(chunk) >= max_clips):
+            yield chunk
+            chunk, used = [], 0
+        chunk.append(clip)
+        used += cost
+    if chunk:
+        yield chunk
+
+def make_chunks(clips: Iterable[Dict], chunk_size: int, token_budget: int = None) -> Iterator[List[Dict]]:
+    """Split clips into per-request chunks by token budget when given, else by count."""
+    if token_budget:
+        return pack_clips_by_tokens(clips, token_budget)
+    return iter_chunks(clips, chunk_size)
+
+def build_ranking_messages(clips: List[Dict], compact: bool = False, structured: bool = False) -> List[Dict]:
+    """Build the chat messages asking the model to rank one chunk of clips.
+
+    With structured, the model is asked for a JSON array instead of markdown.
+    """
+    if structured:
+        answer_format = """Respond with only a JSON array, one object per clip, ranked by viral potential:
+[{"name": "[TITLE]", "start": [START], "end": [END], "score": [1-10], "factors": "[Key viral factors]", "platforms": "[Recommended platforms]"}]
+
+Use the clip's start and end in seconds, an integer score and no other keys. Focus on measurable features in the data."""
+    else:
+        answer_format = """For each clip, provide in this exact format:
+1. **Clip Name: "[TITLE]"**
+   Start: [START]s, End: [END]s
+   Score: [1-10]
+   Factors: [Key viral factors]
+   Platforms: [Recommended platforms]
+
+Rank clips by viral potential. Focus on measurable features in the data."""
 
     prompt = f"""You are an expert content analyzer focusing on viral potential. Analyze these clips:
-{json.dumps(clips, indent=2)}
+{serialize_clips(clips, compact)}
 
 For each clip, evaluate using:
 
@@ -78,38 +306,59 @@ For each clip, evaluate using:
 - "Quotable" phrases
 - Discussion potential
 
-For each clip, provide in this exact format:
-1. **Clip Name: "[TITLE]"**
-   Start: [START]s, End: [END]s
-   Score: [1-10]
-   Factors: [Key viral factors]
-   Platforms: [Recommended platforms]
+{answer_format}"""
 
-Rank clips by viral potential. Focus on measurable features in the data."""
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+def request_completion(messages: List[Dict], api_key: str, site_url: str = "", site_name: str = "",
+                       cache: ResponseCache = None, model: str = RANKING_MODEL,
+                       max_tokens: int = REPLY_TOKENS, stats: RequestStats = None,
+                       temperature: float = 1) -> str:
+    """Send one ranking request, retrying with exponential backoff."""
+    if cache is not None:
+        cache_key = ResponseCache.key(model, messages, temperature=temperature, max_tokens=max_tokens)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    client = OpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=api_key,
+        default_headers={
+            "HTTP-Referer": site_url,
+            "X-Title": site_name,
+        }
+    )
 
     max_retries = 3
     retry_delay = 2
 
     for attempt in range(max_retries):
         try:
+            start = time.time()
             completion = client.chat.completions.create(
-                model="deepseek/deepseek-chat",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that ranks video clips. Keep explanations brief and focused on virality potential."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=1,
-                max_tokens=1000
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
             )
-            
+
             if completion and completion.choices:
-                return completion.choices[0].message.content
+                if stats is not None:
+                    stats.record(time.time() - start, getattr(completion, 'usage', None))
+                content = completion.choices[0].message.content
+                if cache is not None and content:
+                    cache.put(cache_key, content)
+                return content
             
         except Exception as e:
             if attempt < max_retries - 1:
@@ -121,37 +370,281 @@ Rank clips by viral potential. Focus on measurable features in the data."""
     
     return None
 
-def rank_all_clips_parallel(clips: List[Dict], api_key: str, site_url: str = "", site_name: str = "", 
-                          chunk_size: int = 5, num_processes: int = None) -> List[Dict]:
-    """Rank clips in parallel using multiple processes and GPU acceleration."""
+def rank_all_clips_parallel(clips: Iterable[Dict], api_key: str, site_url: str = "", site_name: str = "", 
+                          chunk_size: int = 5, num_processes: int = None,
+                          cache: ResponseCache = None, token_budget: int = None,
+                          structured: bool = False, tracker: 'TopClipsTracker' = None,
+                          model: str = RANKING_MODEL, stats: RequestStats = None) -> List[Dict]:
+    """Rank clips in parallel using multiple processes and GPU acceleration.
+
+    clips may be a lazy iterator (e.g. a followed .jsonl stream); each chunk is
+    submitted as soon as it fills, while later clips are still arriving. With
+    token_budget, chunks are packed to that many tokens instead of chunk_size clips.
+    With structured, replies are JSON validated against RANKED_CLIP_FIELDS.
+    Chunks are collected in completion order and fed to `tracker`, if given.
+    """
     if num_processes is None:
         num_processes = mp.cpu_count()
 
-    chunks = chunk_list(clips, chunk_size)
-    chunk_data = [(chunk, api_key, site_url, site_name, i) for i, chunk in enumerate(chunks)]
-    
     all_ranked_clips = []
     
-    # Setup progress bar
-    pbar = tqdm(total=len(chunks), desc="Processing chunks")
+    # Setup progress bar (total is unknown while following a stream)
+    total = -(-len(clips) // chunk_size) if isinstance(clips, list) and not token_budget else None
+    pbar = tqdm(total=total, desc="Processing chunks")
     
+    def collect(future):
+        try:
+            result = future.result()
+            all_ranked_clips.extend(result)
+            if tracker is not None:
+                tracker.add(result)
+            pbar.update(1)
+        except Exception as e:
+            print(f"Warning: Chunk processing failed: {str(e)}")
+
     # Use ThreadPoolExecutor for parallel API calls
     with ThreadPoolExecutor(max_workers=num_processes) as executor:
-        futures = [executor.submit(process_chunk_gpu, data) for data in chunk_data]
-        
-        for future in futures:
-            try:
-                result = future.result()
-                all_ranked_clips.extend(result)
-                pbar.update(1)
-            except Exception as e:
-                print(f"Warning: Chunk processing failed: {str(e)}")
+        pending = set()
+        for i, chunk in enumerate(make_chunks(clips, chunk_size, token_budget)):
+            pending.add(executor.submit(
+                process_chunk_gpu, chunk, api_key, site_url=site_url, site_name=site_name, chunk_id=i,
+                cache=cache, compact=bool(token_budget), structured=structured, model=model, stats=stats
+            ))
+            # Harvest whatever finished while the next chunk was being read
+            done = {future for future in pending if future.done()}
+            pending -= done
+            for future in done:
+                collect(future)
+
+        for future in as_completed(pending):
+            collect(future)
     
     pbar.close()
     
     # Final sorting of all clips
     return sorted(all_ranked_clips, key=lambda x: x.get('score', 0), reverse=True)
 
+def rank_all_clips_async(clips: Iterable[Dict], api_key: str, site_url: str = "", site_name: str = "",
+                         chunk_size: int = 5, max_concurrency: int = 8, request_timeout: float = 60.0,
+                         base_url: str = OPENROUTER_BASE_URL, adaptive: bool = False,
+                         cache: ResponseCache = None, token_budget: int = None,
+                         structured: bool = False, tracker: 'TopClipsTracker' = None,
+                         hedge_percentile: float = None, hedge_budget: float = 0.1,
+                         model: str = RANKING_MODEL, stats: RequestStats = None) -> List[Dict]:
+    """Rank clips with the asyncio engine: one pooled client, bounded concurrency.
+
+    With adaptive, concurrency grows while latencies stay healthy and halves on 429s
+    and timeouts, up to max_concurrency. With hedge_percentile, slow requests get a
+    duplicate once they pass that latency percentile, for at most hedge_budget of requests.
+    """
+    total = -(-len(clips) // chunk_size) if isinstance(clips, list) and not token_budget else None
+    compact = bool(token_budget)
+    all_ranked_clips = run_ranking_engine(
+        make_chunks(clips, chunk_size, token_budget), api_key, model,
+        lambda chunk: build_ranking_messages(chunk, compact, structured), parse_clip_data, total=total,
+        repair=parse_structured_reply if structured else None, max_reasks=STRUCTURED_REASKS,
+        on_result=tracker.add if tracker is not None else None,
+        site_url=site_url, site_name=site_name, base_url=base_url,
+        max_concurrency=max_concurrency, request_timeout=request_timeout, adaptive=adaptive,
+        cache=cache, hedge_percentile=hedge_percentile, hedge_budget=hedge_budget, stats=stats
+    )
+    return sorted(all_ranked_clips, key=lambda x: x.get('score', 0), reverse=True)
+
+def build_screen_messages(clips: List[Dict]) -> List[Dict]:
+    """Build a short score-only prompt for the screening tier."""
+    lines = "\n".join(json.dumps(dict(id=c['screen_id'], **compact_clip(c)), separators=(',', ':'), ensure_ascii=False)
+                      for c in clips)
+    prompt = f"""Rate the viral potential of each clip from 1 to 10, weighing audio engagement (volume, intensity) at 40% and content (quotability, controversy, discussion potential) at 60%.
+{lines}
+
+Reply with only one line per clip in the form "id: score", and nothing else."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+def parse_screen_scores(reply: str) -> List[Dict]:
+    """Parse "id: score" lines from a screening reply."""
+    return [{'screen_id': int(m.group(1)), 'score': float(m.group(2))}
+            for m in re.finditer(r'^\W*(\d+)\W*[:=-]\s*(\d+(?:\.\d+)?)', reply or "", re.MULTILINE)]
+
+def screen_chunk(clips: List[Dict], api_key: str, site_url: str, site_name: str, model: str,
+                 max_tokens: int, cache: ResponseCache = None, stats: RequestStats = None) -> List[Dict]:
+    try:
+        reply = request_completion(build_screen_messages(clips), api_key, site_url, site_name,
+                                   cache, model, max_tokens, stats)
+        return parse_screen_scores(reply)
+    except Exception as e:
+        print(f"Warning: Failed to screen chunk: {str(e)}")
+        return []
+
+def screen_clips(clips: Iterable[Dict], api_key: str, site_url: str, site_name: str, model: str,
+                 chunk_size: int = 20, max_tokens: int = SCREEN_REPLY_TOKENS, engine: str = 'threads',
+                 num_processes: int = None, cache: ResponseCache = None, stats: RequestStats = None,
+                 **async_options) -> Tuple[List[Dict], Dict[int, float]]:
+    """Score every clip with a cheap model, returning the clips and their scores by index.
+
+    Clips the screen did not score are missing from the scores. clips may be a lazy
+    iterator; it is consumed fully.
+    """
+    seen = []
+
+    def tagged():
+        for clip in clips:
+            seen.append(clip)
+            yield dict(clip, screen_id=len(seen) - 1)
+
+    chunks = iter_chunks(tagged(), chunk_size)
+    if engine == 'async':
+        results = run_ranking_engine(chunks, api_key, model, build_screen_messages, parse_screen_scores,
+                                     site_url=site_url, site_name=site_name, cache=cache,
+                                     max_tokens=max_tokens, stats=stats, **async_options)
+    else:
+        results = []
+        with ThreadPoolExecutor(max_workers=num_processes or mp.cpu_count()) as executor:
+            futures = [executor.submit(screen_chunk, chunk, api_key, site_url, site_name, model,
+                                       max_tokens, cache, stats)
+                       for chunk in chunks]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Screening chunks"):
+                results.extend(future.result())
+
+    scores = {}
+    for result in results:
+        if 0 <= result['screen_id'] < len(seen):
+            scores.setdefault(result['screen_id'], result['score'])
+    return seen, scores
+
+def select_finalists(clips: List[Dict], scores: Dict[int, float], count: int) -> List[Dict]:
+    """Keep the count best-screened clips, in their original order.
+
+    Clips the screen failed to score (a failed call or an unparseable reply) are
+    kept as well, so a broken screen sends everything to the final tier rather than
+    the first clips of the VOD.
+    """
+    best = sorted(scores, key=lambda i: -scores[i])[:count]
+    unscored = [i for i in range(len(clips)) if i not in scores]
+    keep = sorted(best + unscored)
+    if clips and len(scores) < SCREEN_MIN_SCORED_SHARE * len(clips):
+        print(f"Warning: Screening scored only {len(scores)} of {len(clips)} clips; "
+              f"the {len(unscored)} unscored clips all go to the final tier")
+    print(f"Screening scored {len(scores)} of {len(clips)} clips, kept {len(keep)} finalists")
+    return [clips[i] for i in keep]
+
+def seed_key(clip: Dict) -> Tuple:
+    """Deterministic order for clips: chunk score first, then position in the VOD."""
+    return (-clip.get('score', 0), clip.get('start', 0), clip.get('end', 0), clip.get('name', ''))
+
+def select_chunk_winners(ranked_clips: List[Dict], per_chunk: int) -> Tuple[List[Dict], List[Dict]]:
+    """Split ranked clips into the best per_chunk of each chunk and the rest."""
+    by_chunk = {}
+    for clip in ranked_clips:
+        by_chunk.setdefault(clip.get('chunk'), []).append(clip)
+    winners, rest = [], []
+    for chunk_clips in by_chunk.values():
+        chunk_clips.sort(key=seed_key)
+        winners.extend(chunk_clips[:per_chunk])
+        rest.extend(chunk_clips[per_chunk:])
+    return winners, rest
+
+def build_rerank_messages(clips: List[Dict]) -> List[Dict]:
+    """Ask the model to order a small group of already-ranked clips against each other."""
+    lines = "\n".join(
+        json.dumps({'id': i, 'name': c.get('name', ''), 'start': c.get('start'), 'end': c.get('end'),
+                    'factors': c.get('factors', ''), 'platforms': c.get('platforms', '')},
+                   separators=(',', ':'), ensure_ascii=False)
+        for i, c in enumerate(clips))
+    prompt = f"""These clips were each the best of a different batch. Compare them against each other and order them from most to least viral potential.
+{lines}
+
+Reply with only the ids, best first, separated by commas."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+def parse_rerank_order(reply: str, count: int) -> List[int]:
+    """Read an id ordering, ignoring unknown or repeated ids and appending any left out."""
+    order = []
+    for match in re.finditer(r'\d+', reply or ""):
+        i = int(match.group())
+        if i < count and i not in order:
+            order.append(i)
+    return order + [i for i in range(count) if i not in order]
+
+def tournament_rerank(candidates: List[Dict], order_group, group_size: int = 8,
+                      advance: float = 0.5, max_workers: int = None) -> Tuple[List[Dict], int]:
+    """Order candidates with a knockout tournament of small comparison groups.
+
+    Each round splits the field into groups of at most group_size, seeded by
+    seed_key so every group mixes strong and weak chunk scores. order_group ranks a
+    group, and the top `advance` share of it goes through to the next round. The
+    last group's order heads the result. Clips knocked out in later rounds come
+    before those knocked out earlier, then better group placings, then seed_key.
+    That makes ties deterministic. Costs about 2 * len(candidates) / group_size calls.
+    Returns the ordered clips and the number of calls made.
+    """
+    # A group of one never eliminates anyone, so the field would never shrink
+    assert group_size >= 2, "group_size must be at least 2"
+    seeds = {id(clip): rank for rank, clip in enumerate(sorted(candidates, key=seed_key))}
+    alive = sorted(candidates, key=seed_key)
+    eliminated = []
+    calls = 0
+    round_number = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(alive) > group_size:
+            num_groups = math.ceil(len(alive) / group_size)
+            # Snake seeding: 0..n-1 then n-1..0, so groups are balanced
+            groups = [[] for _ in range(num_groups)]
+            for rank, clip in enumerate(alive):
+                lap, pos = divmod(rank, num_groups)
+                groups[pos if lap % 2 == 0 else num_groups - 1 - pos].append(clip)
+
+            orders = list(executor.map(order_group, groups))
+            calls += len(groups)
+            survivors = []
+            for group, order in zip(groups, orders):
+                keep = max(1, math.ceil(len(group) * advance))
+                survivors.extend(group[i] for i in order[:keep])
+                eliminated.extend((round_number, place, seeds[id(group[i])], group[i])
+                                  for place, i in enumerate(order[keep:], keep))
+            alive = sorted(survivors, key=lambda clip: seeds[id(clip)])
+            round_number += 1
+
+        final_order = order_group(alive) if len(alive) > 1 else list(range(len(alive)))
+        calls += len(alive) > 1
+
+    eliminated.sort(key=lambda entry: (-entry[0], entry[1], entry[2]))
+    return [alive[i] for i in final_order] + [clip for _, _, _, clip in eliminated], calls
+
+def global_rerank(ranked_clips: List[Dict], api_key: str, site_url: str = "", site_name: str = "",
+                  per_chunk: int = 2, group_size: int = 8, model: str = RANKING_MODEL,
+                  cache: ResponseCache = None, stats: RequestStats = None,
+                  max_workers: int = None) -> List[Dict]:
+    """Calibrate scores across chunks by re-ranking only the per-chunk winners.
+
+    Winners come first in tournament order and get a global 'rank'. The other
+    clips follow in seed_key order. Failed comparisons keep their seeded order.
+    """
+    winners, rest = select_chunk_winners(ranked_clips, per_chunk)
+
+    def order_group(group: List[Dict]) -> List[int]:
+        try:
+            reply = request_completion(build_rerank_messages(group), api_key, site_url, site_name,
+                                       cache, model, max_tokens=8 * len(group) + 16, stats=stats,
+                                       temperature=0)
+            return parse_rerank_order(reply, len(group))
+        except Exception as e:
+            print(f"Warning: Re-rank comparison failed, keeping chunk order: {str(e)}")
+            return list(range(len(group)))
+
+    ordered, calls = tournament_rerank(winners, order_group, group_size, max_workers=max_workers)
+    reranked = ordered + sorted(rest, key=seed_key)
+    for rank, clip in enumerate(reranked, 1):
+        clip['rank'] = rank
+    print(f"Global re-rank: {len(winners)} chunk winners of {len(ranked_clips)} clips ordered in {calls} calls")
+    return reranked
+
 def parse_clip_data(input_string: str) -> list[dict]:
     if not input_string:
         return []
@@ -200,20 +693,142 @@ def parse_clip_data(input_string: str) -> list[dict]:
     
     return clips
 
-def save_top_clips_json(clips: List[Dict], output_file: str, num_clips: int = 20) -> None:
+def extract_json_array(reply: str) -> Optional[list]:
+    """Pull the JSON array out of a reply, tolerating code fences and surrounding prose."""
+    text = reply.strip()
+    fence = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+    if fence:
+        text = fence.group(1).strip()
+    candidates = [text]
+    if '[' in text and ']' in text:
+        candidates.append(text[text.index('['):text.rindex(']') + 1])
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            # Some models wrap the array, e.g. {"clips": [...]}
+            data = next((v for v in data.values() if isinstance(v, list)), None)
+        if isinstance(data, list):
+            return data
+    return None
+
+def normalize_ranked_clip(item):
+    """Coerce harmless variations (float scores, platform lists) before validation."""
+    if not isinstance(item, dict):
+        return item
+    item = {field: item[field] for field in RANKED_CLIP_FIELDS if field in item}
+    if isinstance(item.get('score'), float) and item['score'].is_integer():
+        item['score'] = int(item['score'])
+    for field in ('factors', 'platforms'):
+        if isinstance(item.get(field), list):
+            item[field] = ", ".join(str(v) for v in item[field])
+    return item
+
+def validate_ranked_clip(item) -> Optional[str]:
+    """Return why a structured ranking item breaks the schema, or None if it is valid."""
+    if not isinstance(item, dict):
+        return "item is not an object"
+    missing = [field for field in RANKED_CLIP_FIELDS if field not in item]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    for field, types in RANKED_CLIP_FIELDS.items():
+        if isinstance(item[field], bool) or not isinstance(item[field], types):
+            return f"{field} has the wrong type"
+    if not item['name'].strip():
+        return "name is empty"
+    if item['end'] <= item['start']:
+        return "end must be after start"
+    if not 1 <= item['score'] <= 10:
+        return "score must be between 1 and 10"
+    return None
+
+def parse_structured_reply(messages: List[Dict], reply: str) -> Tuple[List[Dict], Optional[List[Dict]]]:
+    """Parse a JSON ranking reply into valid clips and, if needed, a re-ask for the rest.
+
+    Only the malformed items are sent back, with the reason each one failed. A reply
+    that is not JSON at all falls back to the markdown parser.
+    """
+    items = extract_json_array(reply)
+    if items is None:
+        return parse_clip_data(reply), None
+
+    valid, problems = [], []
+    for i, item in enumerate(items):
+        item = normalize_ranked_clip(item)
+        error = validate_ranked_clip(item)
+        if error:
+            problems.append(f"- item {i + 1} ({error}): {json.dumps(item, ensure_ascii=False)}")
+        else:
+            valid.append(item)
+    if not problems:
+        return valid, None
+
+    followup = messages + [
+        {"role": "assistant", "content": reply},
+        {"role": "user", "content": "These items in your answer do not match the required schema:\n"
+                                    + "\n".join(problems)
+                                    + "\n\nRespond with only a JSON array holding corrected versions of just these items, "
+                                      "with keys name, start, end, score (integer 1-10), factors and platforms."},
+    ]
+    return valid, followup
+
+def save_top_clips_json(clips: List[Dict], output_file: str, num_clips: int = 20,
+                        total_clips: int = None, complete: bool = True) -> None:
+    """Write the top clips, replacing output_file atomically."""
     top_clips = clips[:num_clips]
     output_data = {
         'top_clips': top_clips,
-        'total_clips': len(clips),
+        'total_clips': len(clips) if total_clips is None else total_clips,
+        'complete': complete,
         'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
     }
-    
+
     try:
-        with open(output_file, 'w') as f:
-            json.dump(output_data, f, indent=2)
+        write_json_atomic(output_file, output_data, indent=2)
     except Exception as e:
         raise RuntimeError(f"Failed to save JSON file: {str(e)}")
 
+class TopClipsTracker:
+    """Running top-K of ranked clips, periodically written out as partial results.
+
+    Clips are kept in a min-heap of size num_clips, so each chunk costs O(n log K).
+    At most every flush_interval seconds the best-so-far clips are saved to
+    output_file with complete=False, letting extraction or the UI start early.
+    """
+
+    def __init__(self, output_file: str, num_clips: int = 20, flush_interval: float = 5.0):
+        self.output_file = output_file
+        self.num_clips = num_clips
+        self.flush_interval = flush_interval
+        self.total = 0
+        self._heap = []
+        self._last_flush = 0.0
+
+    def add(self, clips: List[Dict]) -> None:
+        for clip in clips:
+            # The arrival counter breaks score ties in favour of earlier clips
+            entry = (clip.get('score', 0), -self.total, clip)
+            self.total += 1
+            if len(self._heap) < self.num_clips:
+                heapq.heappush(self._heap, entry)
+            elif entry[:2] > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, entry)
+        if clips and time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def top(self) -> List[Dict]:
+        return [clip for _, _, clip in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+
+    def flush(self) -> None:
+        try:
+            save_top_clips_json(self.top(), self.output_file, self.num_clips,
+                                total_clips=self.total, complete=False)
+        except RuntimeError as e:
+            print(f"Warning: {str(e)}")
+        self._last_flush = time.time()
+
 def main():
     parser = argparse.ArgumentParser(description='Rank and extract top viral video clips metadata using GPU acceleration.')
     parser.add_argument('clips_json', help='JSON file containing clip information')
@@ -221,10 +836,42 @@ def main():
     parser.add_argument('--site_url', default='http://localhost', help='Site URL for OpenRouter API')
     parser.add_argument('--site_name', default='Local Test', help='Site name for OpenRouter API')
     parser.add_argument('--num_clips', type=int, default=20, help='Number of top clips to extract')
+    parser.add_argument('--model', default=RANKING_MODEL, help='Model for full rankings (the finalist tier when screening)')
+    parser.add_argument('--screen_model', default=None, help='Cheap model that scores every clip first; only finalists go to --model')
+    parser.add_argument('--screen_chunk_size', type=int, default=20, help='Number of clips per screening call')
+    parser.add_argument('--screen_max_tokens', type=int, default=SCREEN_REPLY_TOKENS, help='Reply token limit for screening calls')
+    parser.add_argument('--finalists', type=int, default=None, help='Number of screened clips sent to --model (default: twice --num_clips)')
+    parser.add_argument('--rerank', action='store_true', help='Re-rank the per-chunk winners against each other in a tournament to calibrate scores across chunks')
+    parser.add_argument('--rerank_per_chunk', type=int, default=2, help='Clips from each chunk that enter the re-rank tournament')
+    parser.add_argument('--rerank_group_size', type=int, default=8, help='Clips compared per re-rank call')
     parser.add_argument('--chunk_size', type=int, default=5, help='Number of clips to process per API call')
+    parser.add_argument('--token_budget', type=int, default=None, help='Pack each API request up to this many tokens (prompt plus reply) with compactly serialized clips, instead of --chunk_size clips')
+    parser.add_argument('--structured', action='store_true', help='Ask for JSON rankings validated against a schema, re-asking only for malformed items')
     parser.add_argument('--num_processes', type=int, default=None, help='Number of parallel processes (default: CPU count)')
+    parser.add_argument('--prerank_top_k', type=int, default=None, help='Only send the K best clips by local audio pre-score to the LLM')
+    parser.add_argument('--prerank_top_percent', type=float, default=None, help='Only send this top percentage of clips by local audio pre-score to the LLM')
+    parser.add_argument('--engine', default='threads', choices=['threads', 'async'], help='Ranking engine: a thread pool with a client per chunk, or asyncio with one pooled client')
+    parser.add_argument('--max_concurrency', type=int, default=8, help='Maximum concurrent API requests for the async engine')
+    parser.add_argument('--request_timeout', type=float, default=60.0, help='Per-request timeout in seconds for the async engine')
+    parser.add_argument('--adaptive_concurrency', action='store_true', help='Tune async concurrency with AIMD: grow while latencies are healthy, halve on 429s and timeouts')
+    parser.add_argument('--hedge_percentile', type=float, default=None, help='Async engine: duplicate a request still pending after this latency percentile of the run (e.g. 95)')
+    parser.add_argument('--hedge_budget', type=float, default=0.1, help='Maximum fraction of requests that may be hedged')
+    parser.add_argument('--api_base_url', default=OPENROUTER_BASE_URL, help='OpenAI-compatible API base URL for the async engine')
+    parser.add_argument('--cache_dir', default=DEFAULT_CACHE_DIR, help='Directory for cached LLM responses')
+    parser.add_argument('--cache_max_mb', type=float, default=DEFAULT_MAX_BYTES / 1024**2, help='Maximum size of the LLM response cache')
+    parser.add_argument('--cache_ttl_hours', type=float, default=DEFAULT_TTL_SECONDS / 3600, help='Hours before a cached LLM response expires')
+    parser.add_argument('--no_cache', action='store_true', help='Always call the API, without reading or writing the response cache')
+    parser.add_argument('--flush_interval', type=float, default=5.0, help='Seconds between rewrites of the output file with partial top clips while ranking (0 = after every chunk)')
+    parser.add_argument('--follow', action='store_true', help='Tail a streamed .jsonl transcription and rank chunks as they arrive')
+    parser.add_argument('--follow_timeout', type=float, default=None, help='Give up following if the stream gets no new data for this many seconds')
     
     args = parser.parse_args()
+    if args.rerank_group_size < 2:
+        parser.error("--rerank_group_size must be at least 2")
+    if args.engine != 'async':
+        for option in ASYNC_ONLY_OPTIONS:
+            if getattr(args, option) != parser.get_default(option):
+                print(f"Warning: --{option} only applies to --engine async")
     
     start_time = time.time()
     
@@ -240,18 +887,86 @@ def main():
         if not api_key:
             raise ValueError("Please set the OPEN_ROUTER_KEY environment variable")
         
-        clips = load_clips(args.clips_json)
-        ranked_clips = rank_all_clips_parallel(
-            clips, 
-            api_key, 
-            args.site_url, 
-            args.site_name, 
-            args.chunk_size,
-            args.num_processes
-        )
+        cache = None
+        if not args.no_cache:
+            cache = ResponseCache(args.cache_dir, int(args.cache_max_mb * 1024**2), args.cache_ttl_hours * 3600)
         
+        prerank = args.prerank_top_k is not None or args.prerank_top_percent is not None
+        if args.follow and not prerank:
+            clips = iter_clips_jsonl(args.clips_json, follow=True, idle_timeout=args.follow_timeout)
+        elif args.follow:
+            # Pre-scoring compares every clip, so the whole stream is read first
+            print("Pre-ranking needs the complete transcription, waiting for the stream to finish...")
+            clips = list(iter_clips_jsonl(args.clips_json, follow=True, idle_timeout=args.follow_timeout))
+        else:
+            clips = load_clips(args.clips_json)
+        if prerank:
+            clips = select_top_candidates(clips, args.prerank_top_k, args.prerank_top_percent)
+        if args.screen_model:
+            screen_stats = RequestStats(f"Screen tier ({args.screen_model})")
+            clips, scores = screen_clips(
+                clips, api_key, site_url=args.site_url, site_name=args.site_name, model=args.screen_model,
+                chunk_size=args.screen_chunk_size, max_tokens=args.screen_max_tokens, engine=args.engine,
+                num_processes=args.num_processes, cache=cache, stats=screen_stats,
+                max_concurrency=args.max_concurrency,
+                request_timeout=args.request_timeout, base_url=args.api_base_url,
+                adaptive=args.adaptive_concurrency
+            )
+            clips = select_finalists(clips, scores, args.finalists or 2 * args.num_clips)
+        final_stats = RequestStats(f"{'Final tier' if args.screen_model else 'Ranking'} ({args.model})")
+        tracker = TopClipsTracker(args.output_file, args.num_clips, args.flush_interval)
+        if args.engine == 'async':
+            ranked_clips = rank_all_clips_async(
+                clips,
+                api_key,
+                site_url=args.site_url,
+                site_name=args.site_name,
+                chunk_size=args.chunk_size,
+                max_concurrency=args.max_concurrency,
+                request_timeout=args.request_timeout,
+                base_url=args.api_base_url,
+                adaptive=args.adaptive_concurrency,
+                cache=cache,
+                token_budget=args.token_budget,
+                structured=args.structured,
+                tracker=tracker,
+                hedge_percentile=args.hedge_percentile,
+                hedge_budget=args.hedge_budget,
+                model=args.model,
+                stats=final_stats
+            )
+        else:
+            ranked_clips = rank_all_clips_parallel(
+                clips,
+                api_key,
+                site_url=args.site_url,
+                site_name=args.site_name,
+                chunk_size=args.chunk_size,
+                num_processes=args.num_processes,
+                cache=cache,
+                token_budget=args.token_budget,
+                structured=args.structured,
+                tracker=tracker,
+                model=args.model,
+                stats=final_stats
+            )
+
+        if args.rerank:
+            ranked_clips = global_rerank(
+                ranked_clips, api_key, site_url=args.site_url, site_name=args.site_name,
+                per_chunk=args.rerank_per_chunk, group_size=args.rerank_group_size, model=args.model,
+                cache=cache, stats=final_stats, max_workers=args.num_processes
+            )
+
+        if args.screen_model:
+            print(screen_stats.summary())
+        print(final_stats.summary())
         save_top_clips_json(ranked_clips, args.output_file, args.num_clips)
         
+        if cache is not None:
+            print(cache.summary())
+            cache.evict()
+        
         print(f"\nSuccessfully saved top {args.num_clips} clips to {args.output_file}")
         print(f"Total processing time: {time.time() - start_time:.2f} seconds")
         
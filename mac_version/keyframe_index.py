@@ -0,0 +1,158 @@
+import os
+import struct
+import subprocess
+import time
+import numpy as np
+
+# Suffix of the index file written next to the VOD
+INDEX_SUFFIX = '.keyframes.idx'
+
+# Header: magic, format version, flags, source size, source mtime (ns), container start time, keyframe count.
+# It is followed by `count` float64 timestamps and then `count` int64 byte offsets.
+MAGIC = b'KFIX'
+INDEX_VERSION = 1
+HEADER = struct.Struct('<4sHHqqdQ')
+FLAG_BYTE_SEEKABLE = 1
+
+# Containers where a keyframe's packet offset is a valid place to start demuxing
+BYTE_SEEKABLE_FORMATS = ('mpegts',)
+
+# Tolerance when snapping times that were parsed from ffprobe's microsecond output
+SNAP_EPSILON = 1e-4
+
+def index_path(video_path):
+    """Path of the keyframe index for a VOD"""
+    return f"{video_path}{INDEX_SUFFIX}"
+
+def remove_index(video_path):
+    """Delete the keyframe index of a VOD, returning False if there was none"""
+    try:
+        os.remove(index_path(video_path))
+        return True
+    except FileNotFoundError:
+        return False
+
+def source_signature(video_path):
+    """Size and modification time, used to notice when the VOD has changed"""
+    stat = os.stat(video_path)
+    return stat.st_size, stat.st_mtime_ns
+
+class KeyframeIndex:
+    """Keyframe timestamps and byte offsets for the first video stream of a VOD
+
+    `times` are seconds from the container start, the same clock as clip start/end.
+    `offsets` are the byte positions of the keyframe packets. Snapping a time to a
+    keyframe is a binary search.
+    """
+
+    def __init__(self, times, offsets, start_time=0.0, byte_seekable=False):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.start_time = float(start_time)
+        self.byte_seekable = byte_seekable
+
+    def __len__(self):
+        return len(self.times)
+
+    def before(self, t):
+        """Index of the last keyframe at or before t (the first keyframe if t precedes them all)"""
+        return max(int(np.searchsorted(self.times, t + SNAP_EPSILON, side='right')) - 1, 0)
+
+    def after(self, t):
+        """Index of the first keyframe at or after t, or len(self) if there is none"""
+        return int(np.searchsorted(self.times, t - SNAP_EPSILON, side='left'))
+
+    def absolute(self, t):
+        """Source timestamp for a time on the clip clock"""
+        return t + self.start_time
+
+    def save(self, path, signature):
+        """Write the index atomically"""
+        size, mtime_ns = signature
+        flags = FLAG_BYTE_SEEKABLE if self.byte_seekable else 0
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, INDEX_VERSION, flags, size, mtime_ns, self.start_time, len(self)))
+                f.write(self.times.tobytes())
+                f.write(self.offsets.tobytes())
+            os.replace(tmp_path, path)
+        except BaseException:
+            # Don't leave a partial index (e.g. on a full disk) next to the VOD
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, signature):
+        """Read an index, or return None if it is missing, corrupt or for another version of the VOD"""
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return None
+                magic, version, flags, size, mtime_ns, start_time, count = HEADER.unpack(header)
+                if magic != MAGIC or version != INDEX_VERSION or (size, mtime_ns) != tuple(signature):
+                    return None
+                times = np.fromfile(f, dtype=np.float64, count=count)
+                offsets = np.fromfile(f, dtype=np.int64, count=count)
+        except OSError:
+            return None
+        if len(times) != count or len(offsets) != count:
+            return None
+        return cls(times, offsets, start_time, bool(flags & FLAG_BYTE_SEEKABLE))
+
+    @classmethod
+    def build(cls, video_path):
+        """Index every keyframe of the first video stream in one ffprobe demux pass"""
+        process = subprocess.Popen([
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,dts_time,pos,flags:format=format_name,start_time',
+            '-of', 'compact', str(video_path)
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+        times, offsets = [], []
+        format_name, start_time = '', 0.0
+        for line in process.stdout:
+            section, _, rest = line.rstrip('\n').partition('|')
+            fields = dict(item.partition('=')[::2] for item in rest.split('|'))
+            if section == 'packet':
+                timestamp = fields.get('pts_time', 'N/A')
+                if timestamp == 'N/A':
+                    timestamp = fields.get('dts_time', 'N/A')
+                if 'K' in fields.get('flags', '') and timestamp != 'N/A' and fields.get('pos', 'N/A') != 'N/A':
+                    times.append(float(timestamp))
+                    offsets.append(int(fields['pos']))
+            elif section == 'format':
+                format_name = fields.get('format_name', '')
+                if fields.get('start_time', 'N/A') != 'N/A':
+                    start_time = float(fields['start_time'])
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffprobe failed to index keyframes: {stderr.strip()}")
+        if not times:
+            raise RuntimeError(f"No keyframes found in {video_path}")
+
+        order = np.argsort(times, kind='stable')
+        byte_seekable = any(name in BYTE_SEEKABLE_FORMATS for name in format_name.split(','))
+        return cls(np.asarray(times)[order] - start_time, np.asarray(offsets)[order],
+                   start_time, byte_seekable)
+
+    @classmethod
+    def open(cls, video_path):
+        """Load the VOD's index, building and saving it first if it is missing or stale"""
+        path = index_path(video_path)
+        signature = source_signature(video_path)
+        index = cls.load(path, signature)
+        if index is not None:
+            return index
+
+        print(f"Building keyframe index for {video_path}...")
+        start = time.time()
+        index = cls.build(video_path)
+        try:
+            index.save(path, signature)
+        except OSError as e:
+            print(f"Warning: Could not save keyframe index: {str(e)}")
+        print(f"Indexed {len(index)} keyframes in {time.time() - start:.2f} seconds")
+        return index
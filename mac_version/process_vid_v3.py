@@ -8,6 +8,11 @@ import time
 import glob
 import re
 import shutil
+import shlex
+import threading
+
+# Pipeline scripts are run relative to this directory, whatever the caller's cwd
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 def sanitize_filename(filename):
     """Convert filename to safe string without spaces"""
@@ -18,16 +23,55 @@ def sanitize_filename(filename):
     # Add back the .ts extension
     return f"{safe_name}.ts"
 
+# Children flush every line, so their logs are relayed as they are written
+CHILD_ENV = dict(os.environ, PYTHONUNBUFFERED='1')
+
+def relay_output(process):
+    """Copy a child's stdout line by line through print
+    
+    The output then lands wherever sys.stdout points, including a buffer a caller
+    has redirected it to, rather than on the file descriptor the child inherited.
+    """
+    for line in process.stdout:
+        print(line, end='')
+
 def run_script(command):
     try:
         print(f"Running: {command}")
-        process = subprocess.run(command, check=True, shell=True)
+        process = subprocess.Popen(command, shell=True, cwd=SCRIPT_DIR, env=CHILD_ENV,
+                                   stdout=subprocess.PIPE, text=True)
+        relay_output(process)
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
         return True
     except subprocess.CalledProcessError as e:
         print(f"Error running command: {command}")
         print(f"Error: {str(e)}")
         return False
 
+def start_script(command):
+    """Start a pipeline script in the background and return its process"""
+    print(f"Starting: {command}")
+    process = subprocess.Popen(shlex.split(command), cwd=SCRIPT_DIR, env=CHILD_ENV,
+                               stdout=subprocess.PIPE, text=True)
+    process.relay = threading.Thread(target=relay_output, args=(process,), daemon=True)
+    process.relay.start()
+    return process
+
+def wait_script(process, command):
+    """Wait for a background script, reporting failure like run_script"""
+    process.wait()
+    process.relay.join()
+    if process.returncode != 0:
+        print(f"Error running command: {command}")
+        print(f"Error: exit status {process.returncode}")
+        return False
+    return True
+
+def list_ts_files(directory):
+    """Names of the .ts files in a directory"""
+    return {os.path.basename(path) for path in glob.glob(os.path.join(directory, "*.ts"))}
+
 def download_twitch_video(url, quality, session_uuid):
     """Download video using twitchdl and return the path to the downloaded file"""
     print(f"Downloading video from {url}...")
@@ -55,21 +99,23 @@ def download_twitch_video(url, quality, session_uuid):
         print(f"Created output directory structure: {output_dir}")
         
         # Get initial list of .ts files in the downloader directory
-        os.chdir(downloader_dir)
-        initial_files = set(glob.glob("*.ts"))
+        initial_files = list_ts_files(downloader_dir)
         print(f"Initial .ts files in downloader directory: {initial_files}")
             
         # Run twitchdl using the correct command format with quality parameter
-        if not os.path.exists("./twitchdl"):
+        if not os.path.exists(os.path.join(downloader_dir, "twitchdl")):
             raise FileNotFoundError("twitchdl executable not found in go_twitch_downloader directory")
         
         cmd = f'./twitchdl --url "{url}" -q {quality.lstrip("-")}'
         print(f"Running command: {cmd}")
         
+        # Run in the downloader directory without changing this process's cwd,
+        # which a long-lived worker shares between jobs
         process = subprocess.run(
             cmd,
             shell=True,
             check=True,
+            cwd=downloader_dir,
             stderr=subprocess.PIPE,
             stdout=subprocess.PIPE
         )
@@ -83,7 +129,7 @@ def download_twitch_video(url, quality, session_uuid):
         time.sleep(2)
         
         # Get new list of .ts files
-        final_files = set(glob.glob("*.ts"))
+        final_files = list_ts_files(downloader_dir)
         
         # Find new .ts files
         new_files = final_files - initial_files
@@ -96,7 +142,8 @@ def download_twitch_video(url, quality, session_uuid):
             
             # Rename the file if necessary
             if downloaded_file != safe_filename:
-                os.rename(downloaded_file, safe_filename)
+                os.rename(os.path.join(downloader_dir, downloaded_file),
+                          os.path.join(downloader_dir, safe_filename))
                 downloaded_file = safe_filename
             
             # Get full path of the file in the downloader directory
@@ -117,37 +164,21 @@ def download_twitch_video(url, quality, session_uuid):
     except Exception as e:
         print(f"Error downloading video: {str(e)}")
         return None
-    finally:
-        # Always change back to original directory if we've changed it
-        if 'downloader_dir' in locals() and os.getcwd() == downloader_dir:
-            os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-def main():
-    # Check for OpenRouter API key
-    if not os.getenv("OPEN_ROUTER_KEY"):
-        print("Error: OPEN_ROUTER_KEY environment variable is not set")
-        print("Please set it with: export OPEN_ROUTER_KEY='your_key_here'")
-        sys.exit(1)
 
-    # Check command line arguments
-    if len(sys.argv) != 4:
-        print("Usage: python process_video.py <twitch_url> <quality> <uuid>")
-        print("Example: python process_video.py https://www.twitch.tv/videos/1303894071 160p 123e4567-e89b-12d3-a456-426614174000")
-        print("Error: UUID must be provided as the third argument")
-        sys.exit(1)
-
-    twitch_url = sys.argv[1]
-    quality = sys.argv[2]
-    session_uuid = sys.argv[3]
+def run_pipeline(twitch_url, quality, session_uuid, transcribe=None):
+    """Download a VOD, transcribe it, rank clips and extract them
     
+    transcribe, when given, is called with the video path instead of running
+    transcription.py in a fresh interpreter, so a long-lived caller such as a
+    Celery worker can keep its Whisper model loaded between jobs.
+    """
     print(f"Using session UUID: {session_uuid}")
 
     # Download the video
     video_path = download_twitch_video(twitch_url, quality, session_uuid)
     print(f'The video path is {video_path}')
     if not video_path:
-        print("Failed to download video")
-        sys.exit(1)
+        raise RuntimeError("Failed to download video")
 
     try:
         # Extract video ID from URL to keep directory naming consistent
@@ -155,7 +186,7 @@ def main():
         base_name = Path(video_path).stem
         
         # Create FeatureTranscribe directory structure: uuid/FeatureTranscribe/video_id
-        uuid_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), session_uuid)
+        uuid_dir = os.path.join(SCRIPT_DIR, session_uuid)
         feature_transcribe_dir = os.path.join(uuid_dir, "FeatureTranscribe")
         output_dir = os.path.join(feature_transcribe_dir, video_id)
         os.makedirs(output_dir, exist_ok=True)
@@ -167,32 +198,50 @@ def main():
             shutil.copy2(video_path, feature_transcribe_path)
             print(f"Copied video to {feature_transcribe_path}")
 
-        # Step 1: Run enhanced transcription
-        print("\nStep 1: Generating enhanced transcription...")
-        cmd1 = f"python transcription.py {feature_transcribe_path}"
-        if not run_script(cmd1):
-            sys.exit(1)
-
         transcription_json = os.path.join(output_dir, f"{base_name}.enhanced_transcription.json")
-        if not os.path.exists(transcription_json):
-            print(f"Error: Expected transcription file {transcription_json} was not generated")
-            sys.exit(1)
+        transcription_jsonl = os.path.join(output_dir, f"{base_name}.enhanced_transcription.jsonl")
+        # A stream left by an earlier run would be read as this one's
+        if os.path.exists(transcription_jsonl):
+            os.unlink(transcription_jsonl)
 
-        # Step 2: Generate clips JSON using GPU acceleration
-        print("\nStep 2: Processing transcription for clip selection...")
-        cmd2 = (f"python gpu_clip.py {transcription_json} "
+        # Step 2 is started first: it tails the streamed transcription and ranks
+        # chunks while Step 1 is still transcribing
+        print("\nStep 2: Starting clip selection on the streamed transcription...")
+        cmd2 = (f"python gpu_clip.py {transcription_jsonl} --follow "
                 f"--output_file {os.path.join(output_dir, 'top_clips_one.json')} "
                 f"--site_url 'http://localhost' "
                 f"--site_name 'Local Test' "
                 f"--num_clips 20 "
-                f"--chunk_size 5")
-        if not run_script(cmd2):
-            sys.exit(1)
+                f"--chunk_size 5 "
+                f"--follow_timeout 3600 "
+                f"--engine async")
+        ranker = start_script(cmd2)
+
+        # Step 1: Run enhanced transcription
+        print("\nStep 1: Generating enhanced transcription...")
+        try:
+            if transcribe is not None:
+                transcribe(feature_transcribe_path)
+            else:
+                cmd1 = f"python transcription.py {feature_transcribe_path} --single-decode --jsonl"
+                if not run_script(cmd1):
+                    raise RuntimeError("Enhanced transcription failed")
+
+            if not os.path.exists(transcription_json):
+                raise RuntimeError(f"Expected transcription file {transcription_json} was not generated")
+        except BaseException:
+            # The ranker would otherwise wait forever on a stream that never ends
+            ranker.terminate()
+            ranker.wait()
+            ranker.relay.join()
+            raise
+
+        if not wait_script(ranker, cmd2):
+            raise RuntimeError("Clip ranking failed")
 
         clips_json = os.path.join(output_dir, "top_clips_one.json")
         if not os.path.exists(clips_json):
-            print(f"Error: Expected top clips file {clips_json} was not generated")
-            sys.exit(1)
+            raise RuntimeError(f"Expected top clips file {clips_json} was not generated")
 
         # Step 3: Extract video clips
         print("\nStep 3: Extracting clips...")
@@ -200,7 +249,7 @@ def main():
         os.makedirs(clips_output_dir, exist_ok=True)
         cmd3 = f"python clip.py {feature_transcribe_path} {clips_output_dir} {clips_json}"
         if not run_script(cmd3):
-            sys.exit(1)
+            raise RuntimeError("Clip extraction failed")
 
         print("\nAll processing completed successfully!")
         print(f"Generated files:")
@@ -214,5 +263,25 @@ def main():
             os.unlink(video_path)
             print(f"Cleaned up downloaded video file: {video_path}")
 
+def main():
+    # Check for OpenRouter API key
+    if not os.getenv("OPEN_ROUTER_KEY"):
+        print("Error: OPEN_ROUTER_KEY environment variable is not set")
+        print("Please set it with: export OPEN_ROUTER_KEY='your_key_here'")
+        sys.exit(1)
+
+    # Check command line arguments
+    if len(sys.argv) != 4:
+        print("Usage: python process_video.py <twitch_url> <quality> <uuid>")
+        print("Example: python process_video.py https://www.twitch.tv/videos/1303894071 160p 123e4567-e89b-12d3-a456-426614174000")
+        print("Error: UUID must be provided as the third argument")
+        sys.exit(1)
+
+    try:
+        run_pipeline(sys.argv[1], sys.argv[2], sys.argv[3])
+    except RuntimeError as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
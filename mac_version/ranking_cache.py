@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from disk_cache import write_json_atomic, touch_entry, remove_entry, evict_lru
+
+DEFAULT_CACHE_DIR = os.getenv(
+    'CLIPCEPTION_LLM_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'clipception', 'llm_responses')
+)
+DEFAULT_MAX_BYTES = 256 * 1024**2
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+class ResponseCache:
+    """Disk-backed cache of LLM ranking responses.
+
+    Entries are keyed by a hash of the model, the full message list (system and user
+    prompts) and the sampling settings, and stored one JSON file per entry. Entries
+    older than `ttl_seconds` are ignored and removed; `evict()` then trims the least
+    recently used entries until the cache fits in `max_bytes`. Safe to share between
+    threads and event-loop tasks.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        payload = json.dumps({
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.cache_dir / f"{key}.json"
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+
+        if entry is not None and time.time() - entry['created'] > self.ttl_seconds:
+            remove_entry(path)
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        touch_entry(path)
+        return entry['response']
+
+    def put(self, key: str, response: str) -> None:
+        write_json_atomic(self.cache_dir / f"{key}.json", {'created': time.time(), 'response': response})
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones beyond max_bytes."""
+        now = time.time()
+
+        def is_expired(path: Path, stat: os.stat_result) -> bool:
+            # An entry's mtime is at least its creation time, so this is a safe expiry check
+            return now - stat.st_mtime > self.ttl_seconds and self._is_expired(path, now)
+
+        return len(evict_lru(self.cache_dir, self.max_bytes, is_expired=is_expired))
+
+    def _is_expired(self, path: Path, now: float) -> bool:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return now - json.load(f)['created'] > self.ttl_seconds
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return True
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return f"LLM response cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
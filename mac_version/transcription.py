@@ -29,12 +29,31 @@ import torch
 import time
 import numpy as np
 from datetime import timedelta
-from pydub import AudioSegment
 import librosa
 import soundfile as sf
 import os
 import atexit
 import sys
+import hashlib
+import shutil
+import mmap
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from audio_features import describe_audio_features
+from columnar_transcription import COLUMNAR_SUFFIX, write_columnar
+from disk_cache import write_json_atomic, touch_entry, evict_lru
+
+# Whisper expects 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+# Shared cache of enhanced transcriptions, keyed by decoded audio content
+DEFAULT_CACHE_DIR = os.getenv(
+    'CLIPCEPTION_TRANSCRIPTION_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'clipception', 'transcriptions')
+)
+DEFAULT_CACHE_MAX_BYTES = 5 * 1024**3
+# Bump when the enhanced transcription format changes so stale entries are never served
+CACHE_FORMAT_VERSION = 2
 
 def format_time(seconds):
     """Convert seconds into human readable time string"""
@@ -52,50 +71,159 @@ def check_gpu():
         print("No GPU found, using CPU")
         return "cpu"
 
-def extract_audio_features(audio_segment, start_time, end_time):
-    """Extract audio features for a segment including volume and emotional characteristics"""
-    # Convert milliseconds to samples
-    start_sample = int(start_time * 1000)
-    end_sample = int(end_time * 1000)
-    
-    # Extract the specific segment
-    segment = audio_segment[start_sample:end_sample]
-    
-    # Convert to numpy array for analysis
-    samples = np.array(segment.get_array_of_samples())
-    
-    # Calculate basic audio features
-    rms = librosa.feature.rms(y=samples.astype(float))[0]
-    zero_crossing_rate = librosa.feature.zero_crossing_rate(samples.astype(float))[0]
-    spectral_centroid = librosa.feature.spectral_centroid(y=samples.astype(float), sr=segment.frame_rate)[0]
-    
-    # Calculate average values
-    avg_volume = float(np.mean(rms))
-    avg_zcr = float(np.mean(zero_crossing_rate))
-    avg_spectral_centroid = float(np.mean(spectral_centroid))
-    
-    # Determine volume level
-    if avg_volume < 0.1:
-        volume_level = "quiet"
-    elif avg_volume < 0.3:
-        volume_level = "normal"
-    else:
-        volume_level = "loud"
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident memory in MB of this process, or of its largest child with RUSAGE_CHILDREN"""
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and KiB on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def release_pages(samples, start, end):
+    """Drop samples [start, end) of a memory-mapped buffer from this process's resident set
+    
+    The data stays in the OS page cache, so re-reading it is cheap, but pages that have
+    already been processed stop counting against the process and peak RSS stays flat.
+    Arrays that are not memory-mapped are left alone.
+    """
+    mapping = getattr(samples, '_mmap', None)
+    # Only the top-level memmap starts at offset 0 of its mapping
+    if mapping is None or samples.base is not mapping:
+        return
+    lo = start * samples.itemsize // mmap.PAGESIZE * mmap.PAGESIZE
+    hi = end * samples.itemsize // mmap.PAGESIZE * mmap.PAGESIZE
+    if hi > lo:
+        mapping.madvise(mmap.MADV_DONTNEED, lo, hi - lo)
+
+class AudioFeatureIndex:
+    """Frame-level audio features for a whole file, answering segment averages in O(1)
+
+    Spectral centroid comes from one STFT per block, RMS and zero crossing rate are taken
+    in the time domain from the same frames, and each feature is stored as a cumulative
+    sum so the mean over any time range is two lookups. Samples are processed in blocks of frames to keep the
+    spectrogram for multi-hour audio out of memory.
+    """
+
+    def __init__(self, samples, sample_rate, frame_length=2048, hop_length=512, block_frames=4096):
+        self.sample_rate = sample_rate
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+
+        rms, zcr, centroid = self._compute_frames(samples, block_frames)
+        self.num_frames = len(rms)
+        self.rms = rms
+        self._rms_sum = self._prefix_sum(rms)
+        self._zcr_sum = self._prefix_sum(zcr)
+        self._centroid_sum = self._prefix_sum(centroid)
+
+    @staticmethod
+    def _prefix_sum(values):
+        prefix = np.zeros(len(values) + 1, dtype=np.float64)
+        np.cumsum(values, out=prefix[1:])
+        return prefix
+
+    def _compute_frames(self, samples, block_frames):
+        """Compute per-frame RMS, ZCR and spectral centroid in one vectorized pass"""
+        pad = self.frame_length // 2
+        num_frames = 1 + len(samples) // self.hop_length
+        rms = np.empty(num_frames, dtype=np.float32)
+        zcr = np.empty(num_frames, dtype=np.float32)
+        centroid = np.empty(num_frames, dtype=np.float32)
+        released = 0
+
+        for first in range(0, num_frames, block_frames):
+            count = min(block_frames, num_frames - first)
+            # Frames are centered like librosa's defaults, so frame i covers
+            # samples [i * hop - pad, i * hop + pad) with zeros outside the file
+            lo = first * self.hop_length - pad
+            hi = (first + count - 1) * self.hop_length + pad
+            block = np.zeros(hi - lo, dtype=np.float64)
+            src_lo, src_hi = max(lo, 0), min(hi, len(samples))
+            if src_hi > src_lo:
+                block[src_lo - lo:src_hi - lo] = samples[src_lo:src_hi]
+
+            S = np.abs(librosa.stft(block, n_fft=self.frame_length,
+                                    hop_length=self.hop_length, center=False))
+            # RMS from the Hann-windowed spectrogram would read about 0.61x the sample RMS
+            rms[first:first + count] = librosa.feature.rms(
+                y=block, frame_length=self.frame_length,
+                hop_length=self.hop_length, center=False)[0]
+            centroid[first:first + count] = librosa.feature.spectral_centroid(
+                S=S, sr=self.sample_rate, n_fft=self.frame_length)[0]
+            zcr[first:first + count] = librosa.feature.zero_crossing_rate(
+                block, frame_length=self.frame_length,
+                hop_length=self.hop_length, center=False)[0]
+
+            # Samples before the next block's first frame are never read again
+            next_lo = max((first + count) * self.hop_length - pad, 0)
+            release_pages(samples, released, next_lo)
+            released = max(released, next_lo)
+
+        return rms, zcr, centroid
+
+    def frame_range(self, start_time, end_time):
+        """Return the [first, last) frame indices whose centers fall in the time range"""
+        first = int(np.ceil(start_time * self.sample_rate / self.hop_length))
+        last = int(np.floor(end_time * self.sample_rate / self.hop_length)) + 1
+        first = min(max(first, 0), self.num_frames - 1)
+        last = min(max(last, first + 1), self.num_frames)
+        return first, last
+
+    def averages(self, start_time, end_time):
+        """Return (volume, zero crossing rate, spectral centroid) averaged over the range"""
+        first, last = self.frame_range(start_time, end_time)
+        count = last - first
+        return (
+            float((self._rms_sum[last] - self._rms_sum[first]) / count),
+            float((self._zcr_sum[last] - self._zcr_sum[first]) / count),
+            float((self._centroid_sum[last] - self._centroid_sum[first]) / count),
+        )
+
+def segment_features(samples, sample_rate):
+    """Average RMS, zero crossing rate and spectral centroid of one segment's own samples
     
-    # Estimate emotional characteristics based on audio features
-    intensity = "high" if avg_zcr > 0.15 and avg_spectral_centroid > 2000 else "normal"
+    This is the original per-segment computation, kept as the reference the
+    AudioFeatureIndex is checked against.
+    """
+    y = np.asarray(samples, dtype=np.float64)
+    return (
+        float(np.mean(librosa.feature.rms(y=y)[0])),
+        float(np.mean(librosa.feature.zero_crossing_rate(y)[0])),
+        float(np.mean(librosa.feature.spectral_centroid(y=y, sr=sample_rate)[0])),
+    )
+
+def check_feature_index(feature_index, samples, segments, tolerance=0.05):
+    """Compare indexed feature averages with the per-segment computation
     
-    return {
-        "volume": {
-            "level": volume_level,
-            "value": avg_volume
-        },
-        "characteristics": {
-            "intensity": intensity,
-            "zero_crossing_rate": avg_zcr,
-            "spectral_centroid": avg_spectral_centroid
-        }
-    }
+    Prints the largest relative difference of each feature over the segments and returns
+    True when all of them are within tolerance. Frames at segment edges see neighbouring
+    audio in the index but zero padding per segment, so short segments differ slightly.
+    """
+    names = ("volume", "zero crossing rate", "spectral centroid")
+    worst = [0.0, 0.0, 0.0]
+    sample_rate = feature_index.sample_rate
+    for segment in segments:
+        lo = int(segment["start"] * sample_rate)
+        hi = int(segment["end"] * sample_rate)
+        if hi - lo < feature_index.frame_length:
+            continue
+        expected = segment_features(samples[lo:hi], sample_rate)
+        actual = feature_index.averages(segment["start"], segment["end"])
+        for i, (want, got) in enumerate(zip(expected, actual)):
+            worst[i] = max(worst[i], abs(got - want) / max(abs(want), 1e-9))
+    
+    for name, error in zip(names, worst):
+        print(f"Feature check: {name} differs from per-segment values by at most {error:.1%}")
+    return all(error <= tolerance for error in worst)
+
+def extract_audio_features(feature_index, start_time, end_time):
+    """Extract audio features for a segment including volume and emotional characteristics"""
+    avg_volume, avg_zcr, avg_spectral_centroid = feature_index.averages(start_time, end_time)
+    return describe_audio_features(avg_volume, avg_zcr, avg_spectral_centroid)
+
+def load_audio_samples(audio_path):
+    """Decode a wav file once into a mono sample array and its sample rate"""
+    samples, sample_rate = sf.read(str(audio_path), dtype='int16', always_2d=True)
+    # Keep the int16 scale the per-segment pydub path used so feature values are unchanged
+    return samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0], sample_rate
 
 def extract_audio(video_path):
     """Extract audio from video using ffmpeg"""
@@ -117,6 +245,235 @@ def extract_audio(video_path):
     
     return audio_path
 
+def decode_audio(video_path, sample_rate=SAMPLE_RATE):
+    """Decode the audio track straight into memory as 16-bit mono PCM, without a temp file"""
+    print(f"Decoding audio from {video_path}...")
+    
+    result = subprocess.run([
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-i', str(video_path),
+        '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(sample_rate), '-ac', '1',
+        'pipe:1'
+    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode audio: {result.stderr.decode(errors='replace').strip()}")
+    
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+def decode_audio_mapped(video_path, pcm_path, sample_rate=SAMPLE_RATE):
+    """Decode the audio track to a raw 16-bit mono PCM file and memory-map it read-only
+    
+    Nothing but the mapping is held in memory; every later read is a view into the file.
+    """
+    print(f"Decoding audio from {video_path} to {pcm_path}...")
+    
+    # Register before decoding so a partial file is removed on failure too
+    files_to_cleanup.append(str(pcm_path))
+    result = subprocess.run([
+        'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+        '-i', str(video_path),
+        '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(sample_rate), '-ac', '1',
+        str(pcm_path)
+    ], stderr=subprocess.PIPE)
+    
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode audio: {result.stderr.decode(errors='replace').strip()}")
+    
+    if os.path.getsize(pcm_path) == 0:
+        # np.memmap cannot map an empty file
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(pcm_path, dtype=np.int16, mode='r')
+
+def whisper_input(samples):
+    """Convert int16-scale samples to the normalized float32 array Whisper accepts"""
+    return samples.astype(np.float32) / 32768.0
+
+def find_speech_regions(feature_index, margin_db=12.0, floor_db=-55.0,
+                        min_speech=0.5, min_silence=2.0, padding=0.3):
+    """Find (start, end) regions likely to contain speech from the frame RMS energy
+    
+    A frame counts as active when it is margin_db above the stream's noise floor (its 10th
+    percentile level) and above floor_db. Active runs separated by less than min_silence are
+    merged, runs shorter than min_speech are dropped and each region is padded so words at
+    the edges are not clipped.
+    """
+    frames_per_second = feature_index.sample_rate / feature_index.hop_length
+    duration = (feature_index.num_frames - 1) / frames_per_second
+    # RMS is in int16 units, so normalize to dBFS
+    level_db = 20 * np.log10(feature_index.rms / 32768.0 + 1e-10)
+    threshold = max(np.percentile(level_db, 10) + margin_db, floor_db)
+    
+    active = np.concatenate(([False], level_db > threshold, [False]))
+    edges = np.flatnonzero(np.diff(active.astype(np.int8)))
+    runs = edges.reshape(-1, 2) / frames_per_second
+    
+    regions = []
+    for start, end in runs:
+        if regions and start - regions[-1][1] < min_silence:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    
+    padded = []
+    for start, end in regions:
+        if end - start < min_speech:
+            continue
+        start, end = max(start - padding, 0.0), min(end + padding, duration)
+        if padded and start <= padded[-1][1]:
+            padded[-1] = (padded[-1][0], end)
+        else:
+            padded.append((float(start), float(end)))
+    return padded
+
+def find_chunk_boundaries(feature_index, start, end, chunk_length, search_window=5.0):
+    """Split [start, end) into chunks of roughly chunk_length seconds, cutting at the quietest frame
+    
+    Each cut is placed on the lowest-RMS frame within search_window seconds of the nominal
+    boundary so chunks start and end in silence rather than mid-word.
+    """
+    frames_per_second = feature_index.sample_rate / feature_index.hop_length
+    boundaries = [start]
+    target = start + chunk_length
+    while target < end - search_window:
+        first, last = feature_index.frame_range(target - search_window, target + search_window)
+        quietest = first + int(np.argmin(feature_index.rms[first:last]))
+        cut = quietest / frames_per_second
+        if cut <= boundaries[-1]:
+            cut = target
+        boundaries.append(cut)
+        target = cut + chunk_length
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def group_regions(feature_index, regions, chunk_length):
+    """Pack (start, end) regions into chunks of about chunk_length seconds of audio each
+    
+    Regions longer than chunk_length are first cut at quiet frames, so every chunk is a
+    list of regions that are transcribed together.
+    """
+    chunks = []
+    current, current_length = [], 0.0
+    for region_start, region_end in regions:
+        for start, end in find_chunk_boundaries(feature_index, region_start, region_end, chunk_length):
+            current.append((start, end))
+            current_length += end - start
+            if current_length >= chunk_length:
+                chunks.append(current)
+                current, current_length = [], 0.0
+    if current:
+        chunks.append(current)
+    return chunks
+
+def gather_regions(samples, sample_rate, regions):
+    """Return the samples covered by (start, end) regions as one contiguous buffer"""
+    pieces = [samples[int(start * sample_rate):int(end * sample_rate)] for start, end in regions]
+    # A single region is passed through as a view, without copying
+    return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+
+def transcribe_regions(model, audio, regions, sample_rate, fp16=False):
+    """Transcribe audio gathered from regions and map segment times back to VOD time"""
+    result = model.transcribe(whisper_input(audio), language='en', fp16=fp16)
+    
+    # Start of each region in the gathered buffer and in the VOD
+    region_starts = np.array([start for start, _ in regions])
+    lengths = np.array([int(end * sample_rate) - int(start * sample_rate) for start, end in regions])
+    buffer_starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) / sample_rate
+    
+    def to_vod_time(t, side):
+        idx = max(int(np.searchsorted(buffer_starts, t, side=side)) - 1, 0)
+        return float(region_starts[idx] + (t - buffer_starts[idx]))
+    
+    return [
+        {
+            "start": to_vod_time(segment["start"], 'right'),
+            # An end that lands exactly on a join belongs to the earlier region
+            "end": to_vod_time(segment["end"], 'left'),
+            "text": segment["text"]
+        }
+        for segment in result["segments"]
+    ]
+
+# Model owned by each transcription worker process
+_worker_model = None
+
+def _init_transcription_worker(model_size, num_threads):
+    """Load a private Whisper model in a pool process"""
+    global _worker_model
+    torch.set_num_threads(num_threads)
+    _worker_model = whisper.load_model(model_size, device="cpu")
+
+def _transcribe_chunk(chunk):
+    """Transcribe one chunk in a worker and shift its timestamps to VOD time
+    
+    The audio is either the chunk's samples or the path of a PCM file, which the worker
+    maps itself so chunks never have to be copied through the pool's queues.
+    """
+    audio, regions, sample_rate = chunk
+    if isinstance(audio, str):
+        mapped = np.memmap(audio, dtype=np.int16, mode='r')
+        audio = gather_regions(mapped, sample_rate, regions)
+    return transcribe_regions(_worker_model, audio, regions, sample_rate)
+
+def transcribe_chunks_parallel(samples, sample_rate, chunks, model_size, workers):
+    """Transcribe chunks of regions in a process pool and yield segments in global time order"""
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Transcribing {len(chunks)} chunks with {workers} workers ({num_threads} threads each)...")
+    
+    jobs = (
+        (samples.filename if isinstance(samples, np.memmap) else gather_regions(samples, sample_rate, regions),
+         regions, sample_rate)
+        for regions in chunks
+    )
+    
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_transcription_worker,
+                             initargs=(model_size, num_threads)) as executor:
+        # map keeps chunk order, so segments are stitched back in timestamp order
+        for chunk_segments in executor.map(_transcribe_chunk, jobs):
+            yield from chunk_segments
+
+def transcribe_chunks_serial(model, samples, sample_rate, chunks, fp16=False):
+    """Transcribe chunks of regions one after another, yielding each chunk's segments when done"""
+    for regions in chunks:
+        audio = gather_regions(samples, sample_rate, regions)
+        yield from transcribe_regions(model, audio, regions, sample_rate, fp16=fp16)
+        del audio
+        for start, end in regions:
+            release_pages(samples, int(start * sample_rate), int(end * sample_rate))
+
+class JsonlSegmentWriter:
+    """Append combined segments to a JSONL file as they are finalized
+    
+    Each line is one segment in the enhanced transcription schema. The stream ends with an
+    {"end_of_stream": true} record so readers tailing the file know when to stop; it carries
+    an "error" field when transcription failed part way.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, segment):
+        self._file.write(json.dumps(segment, ensure_ascii=False) + "\n")
+        # Flush per record so a tailing reader sees it immediately
+        self._file.flush()
+        self.count += 1
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self, error=None):
+        marker = {"end_of_stream": True, "segments": self.count}
+        if error is not None:
+            marker["error"] = error
+        self._file.write(json.dumps(marker) + "\n")
+        self._file.close()
+
 def combine_segments(segments):
     """Combine multiple segments into a single segment with merged features"""
     if not segments:
@@ -131,72 +488,169 @@ def combine_segments(segments):
     zcrs = [seg["audio_features"]["characteristics"]["zero_crossing_rate"] for seg in segments]
     centroids = [seg["audio_features"]["characteristics"]["spectral_centroid"] for seg in segments]
     
-    avg_volume = np.mean(volumes)
-    avg_zcr = np.mean(zcrs)
-    avg_centroid = np.mean(centroids)
-    
-    volume_level = "loud" if avg_volume >= 0.3 else "normal" if avg_volume >= 0.1 else "quiet"
-    intensity = "high" if avg_zcr > 0.15 and avg_centroid > 2000 else "normal"
-    
     return {
         "start": start_time,
         "end": end_time,
         "text": combined_text,
-        "audio_features": {
-            "volume": {
-                "level": volume_level,
-                "value": float(avg_volume)
-            },
-            "characteristics": {
-                "intensity": intensity,
-                "zero_crossing_rate": float(avg_zcr),
-                "spectral_centroid": float(avg_centroid)
-            }
-        }
+        "audio_features": describe_audio_features(
+            float(np.mean(volumes)), float(np.mean(zcrs)), float(np.mean(centroids))
+        )
     }
 
-def transcribe_with_features(model, audio_path, device, min_duration=15.0):
-    """Get transcription with timestamps and audio features"""
-    print("Generating enhanced transcription...")
-    enhanced_segments = []
-    
-    audio = AudioSegment.from_wav(str(audio_path))
-    
-    transcribe_start = time.time()
-    
-    result = model.transcribe(str(audio_path), language='en', fp16=(device == "cuda"))
-    
+def iter_combined_segments(segments, min_duration):
+    """Group consecutive segments into back-to-back candidates of at least min_duration"""
     current_segments = []
     current_duration = 0.0
     
-    for segment in result["segments"]:
-        audio_features = extract_audio_features(
-            audio,
-            segment["start"],
-            segment["end"]
-        )
-        
-        enhanced_segment = {
-            "start": segment["start"],
-            "end": segment["end"],
-            "text": segment["text"],
-            "audio_features": audio_features
-        }
-        
-        current_segments.append(enhanced_segment)
+    for segment in segments:
+        current_segments.append(segment)
         current_duration = current_segments[-1]["end"] - current_segments[0]["start"]
         
         if current_duration >= min_duration:
             combined_segment = combine_segments(current_segments)
             if combined_segment:
-                enhanced_segments.append(combined_segment)
+                yield combined_segment
             current_segments = []
             current_duration = 0.0
     
     if current_segments:
         combined_segment = combine_segments(current_segments)
         if combined_segment:
-            enhanced_segments.append(combined_segment)
+            yield combined_segment
+
+def iter_sliding_windows(segments, window_length, stride):
+    """Yield overlapping candidate windows over time-ordered segments in linear time
+    
+    Each window starts at a segment and spans every following segment that ends within
+    window_length seconds of its start; the next window starts at the first segment at
+    least stride seconds later (or right after the window, if that comes first), so
+    stride < window_length gives overlapping candidates and no segment is left out.
+    Feature averages come from running prefix sums over the per-segment values, so
+    each window's aggregates cost O(1) and both window edges only move forward. Windows
+    are yielded as soon as the segment that closes them arrives.
+    """
+    window_segments = []
+    volume_sum, zcr_sum, centroid_sum = [0.0], [0.0], [0.0]
+    lo = hi = 0
+    
+    def build(lo, hi):
+        count = hi + 1 - lo
+        return {
+            "start": window_segments[lo]["start"],
+            "end": window_segments[hi]["end"],
+            "text": " ".join(seg["text"].strip() for seg in window_segments[lo:hi + 1]),
+            "audio_features": describe_audio_features(
+                (volume_sum[hi + 1] - volume_sum[lo]) / count,
+                (zcr_sum[hi + 1] - zcr_sum[lo]) / count,
+                (centroid_sum[hi + 1] - centroid_sum[lo]) / count
+            )
+        }
+    
+    def advance(lo):
+        next_start = window_segments[lo]["start"] + stride
+        while lo < len(window_segments) and window_segments[lo]["start"] < next_start:
+            lo += 1
+        return lo
+    
+    for segment in segments:
+        features = segment["audio_features"]
+        window_segments.append(segment)
+        volume_sum.append(volume_sum[-1] + features["volume"]["value"])
+        zcr_sum.append(zcr_sum[-1] + features["characteristics"]["zero_crossing_rate"])
+        centroid_sum.append(centroid_sum[-1] + features["characteristics"]["spectral_centroid"])
+        
+        # The newest segment ends past the window starting at lo, so that window is final
+        while lo < len(window_segments) and segment["end"] > window_segments[lo]["start"] + window_length:
+            limit = window_segments[lo]["start"] + window_length
+            hi = max(hi, lo)
+            while hi + 1 < len(window_segments) and window_segments[hi + 1]["end"] <= limit:
+                hi += 1
+            yield build(lo, hi)
+            # Never skip past the end of this window, so every segment is in some candidate
+            lo = min(advance(lo), hi + 1)
+    
+    # Flush the tail; once a window reaches the last segment the rest are subsets of it
+    while lo < len(window_segments):
+        yield build(lo, len(window_segments) - 1)
+        if window_segments[-1]["end"] <= window_segments[lo]["start"] + window_length:
+            break
+        lo = advance(lo)
+
+def transcribe_with_features(model, samples, sample_rate, device, min_duration=15.0,
+                             model_size="base", workers=1, chunk_length=600.0, vad=False,
+                             on_segment=None, low_memory=False, window_length=None, window_stride=None,
+                             check_features=False):
+    """Get transcription with timestamps and audio features from decoded 16 kHz samples
+    
+    With workers > 1 on CPU the audio is split at silences into chunk_length chunks that are
+    transcribed in a process pool, each process holding its own model. With vad only the
+    speech regions found from the frame energy are passed to Whisper. on_segment is called
+    with each combined segment as soon as it is final; a single-process run then transcribes
+    chunk by chunk so segments arrive before the whole file is done. low_memory also forces
+    chunked transcription, so only one chunk is ever converted for Whisper at a time.
+    With window_length, candidates are overlapping sliding windows advancing by
+    window_stride instead of back-to-back groups of min_duration. check_features compares
+    the indexed feature averages with the per-segment computation and warns on a mismatch.
+    """
+    print("Generating enhanced transcription...")
+    enhanced_segments = []
+    
+    def emit(combined_segment):
+        enhanced_segments.append(combined_segment)
+        if on_segment is not None:
+            on_segment(combined_segment)
+    
+    transcribe_start = time.time()
+    
+    feature_start = time.time()
+    feature_index = AudioFeatureIndex(samples, sample_rate)
+    print(f"Audio feature extraction took: {format_time(time.time() - feature_start)}")
+    
+    duration = len(samples) / sample_rate
+    if vad:
+        regions = find_speech_regions(feature_index)
+        speech = sum(end - start for start, end in regions)
+        print(f"Voice activity: {len(regions)} speech regions, "
+              f"{format_time(speech)} of {format_time(duration)} sent to Whisper")
+    else:
+        regions = [(0.0, duration)]
+    
+    if not regions:
+        segments = []
+    elif workers > 1 and device == "cpu":
+        chunks = group_regions(feature_index, regions, chunk_length)
+        segments = transcribe_chunks_parallel(samples, sample_rate, chunks, model_size, workers)
+    elif on_segment is not None or low_memory:
+        chunks = group_regions(feature_index, regions, chunk_length)
+        segments = transcribe_chunks_serial(model, samples, sample_rate, chunks, fp16=(device == "cuda"))
+    else:
+        # Whisper reads the same buffer as the feature index instead of decoding the file again
+        audio = gather_regions(samples, sample_rate, regions)
+        segments = transcribe_regions(model, audio, regions, sample_rate, fp16=(device == "cuda"))
+    
+    if check_features:
+        # Chunked paths yield segments lazily; the check must not use them up
+        segments = list(segments)
+        if not check_feature_index(feature_index, samples, segments):
+            print("Warning: Indexed audio features do not match the per-segment computation")
+    
+    enhanced = (
+        {
+            "start": segment["start"],
+            "end": segment["end"],
+            "text": segment["text"],
+            "audio_features": extract_audio_features(feature_index, segment["start"], segment["end"])
+        }
+        for segment in segments
+    )
+    
+    if window_length:
+        candidates = iter_sliding_windows(enhanced, window_length, window_stride or window_length)
+    else:
+        candidates = iter_combined_segments(enhanced, min_duration)
+    
+    for combined_segment in candidates:
+        emit(combined_segment)
     
     transcribe_end = time.time()
     print(f"Enhanced transcription processing took: {format_time(transcribe_end - transcribe_start)}")
@@ -214,39 +668,159 @@ def cleanup_files():
                 print(f"Removed file: {file_path}")
         except Exception as e:
             print(f"Warning: Failed to remove {file_path}: {e}")
+    # Long-lived processes call this once per video, so don't retry old paths
+    files_to_cleanup.clear()
 
 # Global list to track files for cleanup
 files_to_cleanup = []
 
-def process_video(video_path, model_size="base"):
-    """Process video to create enhanced transcription"""
+def transcription_cache_key(samples, model_size, min_duration, block_samples=1 << 22, **options):
+    """Hash the decoded audio together with every setting that changes the transcription"""
+    digest = hashlib.blake2b(digest_size=32)
+    settings = {"version": CACHE_FORMAT_VERSION, "model": model_size,
+                "min_duration": float(min_duration), **options}
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    # Hash in blocks so a memory-mapped buffer is never materialized as one bytes object
+    for start in range(0, len(samples), block_samples):
+        digest.update(np.ascontiguousarray(samples[start:start + block_samples], dtype=np.int16).data)
+        release_pages(samples, start, start + block_samples)
+    return digest.hexdigest()
+
+def load_cached_transcription(cache_dir, key):
+    """Return the path of a cached transcription JSON, or None on a miss"""
+    cache_path = Path(cache_dir) / f"{key}.json"
+    return cache_path if touch_entry(cache_path) else None
+
+def store_cached_transcription(cache_dir, key, segments, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """Add a finished transcription to the cache, then evict least recently used entries"""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(cache_dir / f"{key}.json", segments, indent=2)
+    evict_transcription_cache(cache_dir, max_bytes)
+
+def evict_transcription_cache(cache_dir, max_bytes):
+    """Delete the least recently used entries until the cache fits in max_bytes"""
+    for path in evict_lru(cache_dir, max_bytes):
+        print(f"Evicted cached transcription: {path.name}")
+
+# Whisper models already loaded in this process, keyed by (model_size, device)
+_loaded_models = {}
+
+def get_model(model_size, device):
+    """Load a Whisper model once per process and reuse it on later calls"""
+    key = (model_size, device)
+    if key not in _loaded_models:
+        print(f"Loading Whisper {model_size} model...")
+        model = whisper.load_model(model_size)
+        if device == "cuda":
+            model = model.cuda()
+        _loaded_models[key] = model
+    else:
+        print(f"Reusing resident Whisper {model_size} model")
+    return _loaded_models[key]
+
+def process_video(video_path, model_size="base", single_decode=False, workers=1, chunk_length=600.0,
+                  min_duration=15.0, cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES,
+                  vad=False, stream_jsonl=False, low_memory=False, output_format="json",
+                  window_length=None, window_stride=None, check_features=False):
+    """Process video to create enhanced transcription
+    
+    With single_decode the audio is piped from ffmpeg into memory once and shared by
+    Whisper and the feature extractor, so no temporary wav is written. workers and
+    chunk_length control chunked parallel transcription on CPU. Results are cached in
+    cache_dir by audio content and settings; pass cache_dir=None to disable the cache.
+    vad skips non-speech stretches before transcription. stream_jsonl additionally appends
+    each combined segment to a .enhanced_transcription.jsonl file as soon as it is final.
+    low_memory decodes to a memory-mapped PCM file so peak RSS does not grow with VOD length.
+    output_format selects the .enhanced_transcription.json export, the memory-mappable
+    .enhanced_transcription.cols columnar artifact, or both. window_length and window_stride
+    switch candidate generation to overlapping sliding windows. check_features verifies the
+    indexed audio features against the per-segment computation; such diagnostic runs always
+    transcribe and neither read nor write the cache.
+    """
     process_start = time.time()
     device = check_gpu()
     
     video_file = Path(video_path)
     transcription_path = video_file.with_suffix('.enhanced_transcription.json')
+    columnar_path = video_file.with_suffix(COLUMNAR_SUFFIX)
+    jsonl_writer = JsonlSegmentWriter(video_file.with_suffix('.enhanced_transcription.jsonl')) if stream_jsonl else None
     
     print(f"Processing {video_file.name}...")
     
     try:
-        audio_path = extract_audio(video_path)
+        if low_memory:
+            samples, sample_rate = decode_audio_mapped(video_path, video_file.with_suffix('.pcm')), SAMPLE_RATE
+        elif single_decode:
+            samples, sample_rate = decode_audio(video_path), SAMPLE_RATE
+        else:
+            audio_path = extract_audio(video_path)
+            samples, sample_rate = load_audio_samples(audio_path)
         
-        print(f"Loading Whisper {model_size} model...")
-        model = whisper.load_model(model_size)
-        if device == "cuda":
-            model = model.cuda()
+        cache_key = None
+        if cache_dir and not check_features:
+            # Chunked runs cut the audio at quiet frames before Whisper, which changes the
+            # segments; the chunk boundaries do not depend on how many workers share them
+            chunked = (workers > 1 and device == "cpu") or stream_jsonl or low_memory
+            cache_key = transcription_cache_key(samples, model_size, min_duration, vad=vad,
+                                                window_length=window_length, window_stride=window_stride,
+                                                chunk_length=chunk_length if chunked else None)
+            cache_path = load_cached_transcription(cache_dir, cache_key)
+            if cache_path:
+                print(f"Reused cached transcription {cache_key[:12]} from {cache_dir}")
+                if output_format in ("json", "both"):
+                    shutil.copyfile(cache_path, transcription_path)
+                if jsonl_writer or output_format in ("columnar", "both"):
+                    with open(cache_path, 'r', encoding='utf-8') as f:
+                        cached_segments = json.load(f)
+                    if jsonl_writer:
+                        for segment in cached_segments:
+                            jsonl_writer.write(segment)
+                        jsonl_writer.close()
+                    if output_format in ("columnar", "both"):
+                        write_columnar(columnar_path, cached_segments)
+                print(f"Total processing time: {format_time(time.time() - process_start)}")
+                print(f"Enhanced transcription saved next to {video_file}")
+                return
         
-        enhanced_transcription = transcribe_with_features(model, audio_path, device)
+        if workers > 1 and device == "cpu":
+            # Each pool process loads its own copy, so skip the model in this process
+            model = None
+        else:
+            if workers > 1:
+                print("Parallel transcription is CPU-only, using a single GPU model")
+            model = get_model(model_size, device)
         
-        with open(transcription_path, 'w', encoding='utf-8') as f:
-            json.dump(enhanced_transcription, f, indent=2, ensure_ascii=False)
+        enhanced_transcription = transcribe_with_features(
+            model, samples, sample_rate, device, min_duration=min_duration,
+            model_size=model_size, workers=workers, chunk_length=chunk_length, vad=vad,
+            on_segment=jsonl_writer.write if jsonl_writer else None, low_memory=low_memory,
+            window_length=window_length, window_stride=window_stride,
+            check_features=check_features
+        )
+        if jsonl_writer:
+            jsonl_writer.close()
+        
+        if output_format in ("json", "both"):
+            with open(transcription_path, 'w', encoding='utf-8') as f:
+                json.dump(enhanced_transcription, f, indent=2, ensure_ascii=False)
+            print(f"Enhanced transcription saved to {transcription_path}")
+        if output_format in ("columnar", "both"):
+            write_columnar(columnar_path, enhanced_transcription)
+            print(f"Columnar transcription saved to {columnar_path}")
+        
+        if cache_key:
+            store_cached_transcription(cache_dir, cache_key, enhanced_transcription, cache_max_bytes)
         
         process_end = time.time()
         print(f"Total processing time: {format_time(process_end - process_start)}")
-        print(f"Enhanced transcription saved to {transcription_path}")
+        print(f"Peak RSS: {peak_rss_mb():.0f} MB (largest child process: "
+              f"{peak_rss_mb(resource.RUSAGE_CHILDREN):.0f} MB)")
         
     except Exception as e:
         print(f"Error processing video: {str(e)}")
+        if jsonl_writer and not jsonl_writer.closed:
+            jsonl_writer.close(error=str(e))
         raise
     finally:
         # Clean up the audio file even if there was an error
@@ -260,14 +834,59 @@ def main():
                       help='Whisper model size to use')
     parser.add_argument('--min-duration', type=float, default=15.0,
                       help='Minimum duration in seconds for combined segments')
+    parser.add_argument('--window-length', type=float, default=None,
+                      help='Generate sliding-window candidates of this many seconds instead of --min-duration groups')
+    window_step = parser.add_mutually_exclusive_group()
+    window_step.add_argument('--window-stride', type=float, default=None,
+                      help='Seconds between sliding-window starts (default: window length, no overlap)')
+    window_step.add_argument('--window-overlap', type=float, default=None,
+                      help='Seconds of overlap between consecutive sliding windows')
+    parser.add_argument('--single-decode', action='store_true',
+                      help='Decode audio once into memory and share it between Whisper and feature extraction')
+    parser.add_argument('--workers', type=int, default=1,
+                      help='Number of CPU transcription processes, each with its own model')
+    parser.add_argument('--chunk-length', type=float, default=600.0,
+                      help='Target chunk length in seconds for parallel transcription')
+    parser.add_argument('--vad', action='store_true',
+                      help='Only transcribe speech regions found by an energy-based voice activity pass')
+    parser.add_argument('--jsonl', action='store_true',
+                      help='Also stream segments to a .enhanced_transcription.jsonl file as they are finalized')
+    parser.add_argument('--low-memory', action='store_true',
+                      help='Memory-map decoded PCM from disk so peak RSS stays bounded for very long VODs')
+    parser.add_argument('--format', default='json', choices=['json', 'columnar', 'both'],
+                      help='Write the JSON export, the memory-mappable columnar artifact, or both')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                      help='Shared directory for cached transcriptions')
+    parser.add_argument('--cache-max-gb', type=float, default=DEFAULT_CACHE_MAX_BYTES / 1024**3,
+                      help='Maximum size of the transcription cache before LRU eviction')
+    parser.add_argument('--no-cache', action='store_true',
+                      help='Always transcribe, without reading or writing the cache')
+    parser.add_argument('--check-features', action='store_true',
+                      help='Compare indexed audio features with the per-segment computation and report the difference')
     
     args = parser.parse_args()
     
+    if not args.window_length and (args.window_stride is not None or args.window_overlap is not None):
+        parser.error("--window-stride and --window-overlap require --window-length")
+    window_stride = args.window_stride
+    if args.window_length and args.window_overlap is not None:
+        window_stride = args.window_length - args.window_overlap
+    if window_stride is not None and window_stride <= 0:
+        parser.error("sliding-window stride must be positive (overlap must be less than the window length)")
+    
     # Register cleanup function to run at exit
     atexit.register(cleanup_files)
     
     try:
-        process_video(args.video_path, model_size=args.model)
+        process_video(args.video_path, model_size=args.model, single_decode=args.single_decode,
+                      workers=args.workers, chunk_length=args.chunk_length,
+                      min_duration=args.min_duration,
+                      cache_dir=None if args.no_cache else args.cache_dir,
+                      cache_max_bytes=int(args.cache_max_gb * 1024**3),
+                      vad=args.vad, stream_jsonl=args.jsonl, low_memory=args.low_memory,
+                      output_format=args.format,
+                      window_length=args.window_length, window_stride=window_stride,
+                      check_features=args.check_features)
     except Exception as e:
         print(f"Failed to process video: {str(e)}")
         sys.exit(1)
@@ -3,6 +3,9 @@ from flask_cors import CORS
 import json
 import subprocess
 import os
+import sys
+import io
+from contextlib import redirect_stdout
 from pathlib import Path
 from celery import Celery
 
@@ -21,6 +24,19 @@ celery = Celery(
 )
 celery.conf.update(app.config)
 
+# Run transcription inside the worker process so the Whisper model stays loaded between
+# tasks, instead of paying torch import and model load time on every job
+RESIDENT_TRANSCRIPTION = os.getenv('CLIPCEPTION_RESIDENT_TRANSCRIPTION', '1') != '0'
+RESIDENT_MODEL_SIZE = os.getenv('CLIPCEPTION_WHISPER_MODEL', 'base')
+
+# Recycle worker processes when their resident memory grows past this limit (KiB)
+# rather than after a fixed number of tasks, which would throw the model away.
+# This is the only place the recycle policy is set; celeryconfig.py is not loaded.
+celery.conf.worker_max_tasks_per_child = None
+celery.conf.worker_max_memory_per_child = int(
+    os.getenv('CLIPCEPTION_WORKER_MAX_MEMORY_KB', 6 * 1024 * 1024)
+)
+
 # Store active processes
 active_processes = {}
 
@@ -71,6 +87,70 @@ def get_video_options_task(self, url):
             'task_id': self.request.id
         }
 
+class ResidentPipelineError(Exception):
+    """A resident pipeline run failed; carries the output captured up to the failure"""
+
+    def __init__(self, message, output):
+        super().__init__(message)
+        self.output = output
+
+def run_resident_pipeline(url, resolution, uuid):
+    """Run process_vid_v3 in this worker, transcribing with the process-wide Whisper model"""
+    mac_version_path = str(Path(__file__).parent / 'mac_version')
+    if mac_version_path not in sys.path:
+        sys.path.insert(0, mac_version_path)
+    # Imported lazily so the Flask process never loads torch or Whisper
+    import process_vid_v3
+    import transcription
+
+    def transcribe(video_path):
+        transcription.process_video(video_path, model_size=RESIDENT_MODEL_SIZE,
+                                    single_decode=True, stream_jsonl=True)
+
+    # The pipeline relays its child scripts' output through print, so it is captured here too
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            process_vid_v3.run_pipeline(url, resolution, uuid, transcribe=transcribe)
+    except Exception as e:
+        raise ResidentPipelineError(str(e), output.getvalue()) from e
+    print(f'Worker peak RSS after task {uuid}: {transcription.peak_rss_mb():.0f} MB')
+    return output.getvalue()
+
+def run_pipeline_subprocess(task, url, resolution, uuid, mac_version_path):
+    """Run process_vid_v3.py in a fresh interpreter and return its output"""
+    # Execute the updated video processing script with UUID
+    print("here we go") 
+    command = ['python', 'process_vid_v3.py', url, resolution, uuid]
+    print(f"Executing command: {' '.join(command)}")
+    
+    # Run the process and wait for it to complete
+    process = subprocess.Popen(
+        command,
+        cwd=mac_version_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    
+    # Store task ID in process metadata for potential cancellation
+    process.task_id = task.request.id
+    active_processes[task.request.id] = process
+    
+    print(f'Started process with task ID: {task.request.id}')
+
+    # Wait for the process to complete
+    stdout, stderr = process.communicate()
+    
+    # Remove the process from active processes once complete
+    if task.request.id in active_processes:
+        del active_processes[task.request.id]
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+
+    return stdout
+
 @celery.task(bind=True)
 def process_video_task(self, url, resolution, uuid):
     """Celery task to process video with the specified URL, resolution, and UUID."""
@@ -79,35 +159,10 @@ def process_video_task(self, url, resolution, uuid):
         # Change directory to mac_version
         mac_version_path = Path(__file__).parent / 'mac_version'
 
-        # Execute the updated video processing script with UUID
-        print("here we go") 
-        command = ['python', 'process_vid_v3.py', url, resolution, uuid]
-        print(f"Executing command: {' '.join(command)}")
-        
-        # Run the process and wait for it to complete
-        process = subprocess.Popen(
-            command,
-            cwd=mac_version_path,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        # Store task ID in process metadata for potential cancellation
-        process.task_id = self.request.id
-        active_processes[self.request.id] = process
-        
-        print(f'Started process with task ID: {self.request.id}')
-
-        # Wait for the process to complete
-        stdout, stderr = process.communicate()
-        
-        # Remove the process from active processes once complete
-        if self.request.id in active_processes:
-            del active_processes[self.request.id]
-
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+        if RESIDENT_TRANSCRIPTION:
+            stdout = run_resident_pipeline(url, resolution, uuid)
+        else:
+            stdout = run_pipeline_subprocess(self, url, resolution, uuid, mac_version_path)
 
         # Extract video ID from the output or from URL
         # Look for the video ID in the URL
@@ -153,6 +208,14 @@ def process_video_task(self, url, resolution, uuid):
             'task_id': self.request.id
         }
     
+    except ResidentPipelineError as e:
+        return {
+            'success': False,
+            'error': f'Script execution failed: {str(e)}',
+            'script_output': e.output,
+            'task_id': self.request.id
+        }
+    
     except Exception as e:
         return {
             'success': False,